@@ -0,0 +1,67 @@
+'''Benchmark SimpleTest wait states against a fake Nova endpoint
+
+Measures how long it takes for the wait states to notice that all servers
+have gone ACTIVE and called home, and how many API calls that takes, with
+the old one-server-per-call polling and the batched polling.
+
+Usage: python benchmarks/bench_polling.py [COUNT ...]
+'''
+from __future__ import print_function, unicode_literals
+
+import sys
+import time
+
+from os_nova_servertester.fake import FakeClient
+from os_nova_servertester.tests import SimpleTest
+
+API_LATENCY = 0.005
+POLL_INTERVAL = 0.05
+BUILD_DELAY = 0.2
+
+
+def legacy_wait(test):
+    '''Polling strategy used before batching: one get + sleep per server'''
+    wait_servers = test.servers[:]
+    while wait_servers:
+        server = test.client.servers.get(wait_servers.pop(0))
+        if server.status != 'ACTIVE':
+            wait_servers.append(server)
+        time.sleep(POLL_INTERVAL)
+    wait_servers = test.servers[:]
+    while wait_servers:
+        server = test.client.servers.get(wait_servers.pop(0))
+        if server.metadata.get(test.TEST_STATUS_KEY) != \
+                test.TEST_STATUS_COMPLETE:
+            wait_servers.append(server)
+        time.sleep(POLL_INTERVAL)
+
+
+def batched_wait(test):
+    test.state_wait_for_active()
+    test.state_wait_for_callhome_events()
+
+
+def run(count, wait):
+    client = FakeClient(latency=API_LATENCY, build_delay=BUILD_DELAY)
+    test = SimpleTest(None, 'image', 'flavor', count=count,
+                      poll_interval=POLL_INTERVAL, client=client)
+    test.state_create_servers()
+    client.calls.clear()
+    start = time.time()
+    wait(test)
+    # Time spent after the last server was ready is pure tester overhead
+    return time.time() - start - BUILD_DELAY, client.total_calls
+
+
+def main(counts):
+    print('{:>6} {:>14} {:>8} {:>14} {:>8}'.format(
+        'count', 'legacy lag(s)', 'calls', 'batched lag(s)', 'calls'))
+    for count in counts:
+        legacy = run(count, legacy_wait)
+        batched = run(count, batched_wait)
+        print('{:>6} {:>14.3f} {:>8} {:>14.3f} {:>8}'.format(
+            count, legacy[0], legacy[1], batched[0], batched[1]))
+
+
+if __name__ == '__main__':
+    main([int(x) for x in sys.argv[1:]] or [10, 50, 200])
@@ -0,0 +1,92 @@
+'''Scale benchmark for the tester itself, run against the fake cloud
+
+Drives complete SimpleTest workflows (prepare, create, wait, callhome,
+cleanup) against os_nova_servertester.fake at several server counts and
+reports wall time, API calls made and peak Python memory, so that
+regressions in tests.py show up without a real cloud.
+
+Usage: python benchmarks/bench_scale.py [--pipeline] [COUNT ...]
+'''
+from __future__ import print_function, unicode_literals
+
+import argparse
+import logging
+import time
+
+from os_nova_servertester.fake import FakeClient
+from os_nova_servertester.tests import SimpleTest
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def run(count, args):
+    client = FakeClient(
+        latency=args.latency,
+        rate_limit=args.rate_limit,
+        build_delay=args.build_delay,
+        callhome_delay=args.callhome_delay,
+        delete_delay=args.delete_delay,
+        page_size=args.page_size)
+    test = SimpleTest(
+        None, 'fake-image', 'fake-flavor',
+        count=count,
+        client=client,
+        pipeline=args.pipeline,
+        poll_interval=args.poll_interval,
+        poll_max_interval=args.poll_interval * 4,
+        create_concurrency=args.concurrency,
+        delete_concurrency=args.concurrency,
+        wait_for_delete=True,
+        build_timeout=600,
+        callhome_timeout=600)
+    if tracemalloc:
+        tracemalloc.start()
+    start = time.time()
+    test.begin()
+    wall = time.time() - start
+    peak = None
+    if tracemalloc:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return dict(
+        outcome=test.outcome,
+        wall=wall,
+        calls=client.total_calls,
+        rate_limited=client.rate_limited,
+        polls=client.calls.get('GET /servers/detail', 0),
+        peak=peak)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('counts', metavar='COUNT', type=int, nargs='*',
+                        default=[10, 100, 1000])
+    parser.add_argument('--pipeline', action='store_true')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.002)
+    parser.add_argument('--rate-limit', type=int, default=0)
+    parser.add_argument('--build-delay', type=float, default=0.5)
+    parser.add_argument('--callhome-delay', type=float, default=0.5)
+    parser.add_argument('--delete-delay', type=float, default=0.2)
+    parser.add_argument('--poll-interval', type=float, default=0.1)
+    # Below the largest count, so that listing has to page
+    parser.add_argument('--page-size', type=int, default=250)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    print('{:>6} {:>9} {:>9} {:>7} {:>8} {:>10} {:>10}'.format(
+        'count', 'outcome', 'wall(s)', 'calls', 'polls', 'limited',
+        'peak(KiB)'))
+    for count in args.counts:
+        res = run(count, args)
+        print('{:>6} {:>9} {:>9.2f} {:>7} {:>8} {:>10} {:>10}'.format(
+            count, res['outcome'], res['wall'], res['calls'], res['polls'],
+            res['rate_limited'],
+            res['peak'] // 1024 if res['peak'] is not None else '-'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+'''Startup benchmark for the tester command line
+
+Runs the CLI in fresh interpreters for paths that must stay cheap (--help
+and the offline render-userdata command) and reports the median wall time
+of each and whether the client stack (novaclient, keystoneauth) got
+imported. The bare interpreter startup is included for reference.
+
+Usage: python benchmarks/bench_startup.py [--runs N]
+'''
+from __future__ import print_function, unicode_literals
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+HEAVY = ('novaclient', 'keystoneauth1', 'requests')
+
+RUNNER = '''
+import sys
+sys.argv = ['os_nova_servertester'] + sys.argv[1:]
+from os_nova_servertester.cmd import tester
+try:
+    tester.main()
+except SystemExit:
+    pass
+heavy = sorted(set(m.split('.')[0] for m in sys.modules
+                   if m.split('.')[0] in {heavy!r}))
+sys.stderr.write('HEAVY:' + ','.join(heavy) + '\\n')
+'''.format(heavy=HEAVY)
+
+CASES = (
+    ('interpreter', ['-c', 'pass']),
+    ('--help', ['-c', RUNNER, '--help']),
+    ('usage error', ['-c', RUNNER, '--count', 'x']),
+    ('render-userdata', ['-c', RUNNER, 'render-userdata']),
+    ('render-userdata gzip',
+     ['-c', RUNNER, 'render-userdata', '--compress-userdata']),
+)
+
+
+def run(argv, runs):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        x for x in (root, env.get('PYTHONPATH')) if x)
+    times = []
+    heavy = '-'
+    for _ in range(runs):
+        start = time.time()
+        proc = subprocess.Popen([sys.executable] + argv, env=env,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        _, err = proc.communicate()
+        times.append(time.time() - start)
+        for line in err.decode('utf-8', 'replace').splitlines():
+            if line.startswith('HEAVY:'):
+                heavy = line[len('HEAVY:'):] or 'none'
+    times.sort()
+    return times[len(times) // 2], heavy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    print('{:<22} {:>10} {}'.format('case', 'median(ms)', 'client stack'))
+    for name, argv in CASES:
+        median, heavy = run(argv, args.runs)
+        print('{:<22} {:>10.1f} {}'.format(name, median * 1000, heavy))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+from __future__ import print_function, unicode_literals
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+
+
+def default_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME',
+                          os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'os-nova-servertester')
+
+
+class ResolutionCache(object):
+    '''On-disk cache of flavor name -> id resolutions
+
+    Entries are keyed by a scope (auth url and project), the kind of the
+    resource and the name the user gave, and expire after ttl seconds.
+    The file is rewritten atomically so concurrent runs do not corrupt it.
+    With persist=False the cache only lives in memory, which is still
+    useful for sharing lookups between tests running in one process.
+    '''
+
+    def __init__(self, path=None, ttl=3600, persist=True):
+        self.path = path or os.path.join(default_cache_dir(), 'resolve.json')
+        self.ttl = ttl
+        self.persist = persist
+        self.lock = threading.Lock()
+        self.entries = None
+
+    def _key(self, scope, kind, name):
+        return '|'.join((scope, kind, name))
+
+    def _load(self):
+        if self.entries is None:
+            self.entries = {}
+            if not self.persist:
+                return self.entries
+            try:
+                with open(self.path) as f:
+                    self.entries = json.load(f)
+            except (IOError, OSError, ValueError):
+                self.entries = {}
+        return self.entries
+
+    def _save(self):
+        if not self.persist:
+            return
+        dirname = os.path.dirname(self.path)
+        try:
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.resolve')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.entries, f)
+            os.rename(tmp, self.path)
+        except (IOError, OSError) as e:
+            LOG.warning('Cannot write resolution cache %s: %s', self.path, e)
+
+    def get(self, scope, kind, name):
+        with self.lock:
+            entry = self._load().get(self._key(scope, kind, name))
+        if entry and time.time() - entry['time'] < self.ttl:
+            return entry['id']
+        return None
+
+    def put(self, scope, kind, name, resource_id):
+        with self.lock:
+            self._load()[self._key(scope, kind, name)] = dict(
+                id=resource_id, time=time.time())
+            self._save()
+
+    def invalidate(self, scope, kind, name):
+        with self.lock:
+            if self._load().pop(self._key(scope, kind, name), None):
+                self._save()
+
+
+class UserdataCache(object):
+    '''Cache of rendered userdata keyed by a hash of its inputs
+
+    Entries are kept in memory and, with persist set, as files in the user
+    cache dir so that later runs with the same inputs can reuse them. The
+    inputs include the auth token embedded in the shim, so the files are
+    only readable by the owner and are removed after ttl seconds.
+    '''
+
+    def __init__(self, path=None, ttl=86400, persist=True):
+        self.path = path or os.path.join(default_cache_dir(), 'userdata')
+        self.ttl = ttl
+        self.persist = persist
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(*inputs):
+        digest = hashlib.sha256()
+        for item in inputs:
+            if not isinstance(item, bytes):
+                item = '{!r}'.format(item).encode('utf-8')
+            digest.update(item)
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                return self.entries[key]
+        if not self.persist:
+            return None
+        path = os.path.join(self.path, key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+            with open(path, 'rb') as f:
+                data = json.loads(f.read().decode('utf-8'))
+        except (IOError, OSError, ValueError):
+            return None
+        userdata = data['userdata']
+        if data.get('binary'):
+            userdata = base64.b64decode(userdata)
+        with self.lock:
+            self.entries[key] = userdata
+        return userdata
+
+    def put(self, key, userdata):
+        with self.lock:
+            self.entries[key] = userdata
+        if not self.persist:
+            return
+        if isinstance(userdata, bytes):
+            data = dict(binary=True,
+                        userdata=base64.b64encode(userdata).decode('ascii'))
+        else:
+            data = dict(userdata=userdata)
+        try:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path, 0o700)
+            self._prune()
+            fd, tmp = tempfile.mkstemp(dir=self.path, prefix='.userdata')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(json.dumps(data).encode('utf-8'))
+            os.rename(tmp, os.path.join(self.path, key))
+        except (IOError, OSError) as e:
+            LOG.warning('Cannot write userdata cache %s: %s', self.path, e)
+
+    def _prune(self):
+        now = time.time()
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            try:
+                if now - os.path.getmtime(path) > self.ttl:
+                    os.unlink(path)
+            except OSError:
+                pass
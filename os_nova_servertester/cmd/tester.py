@@ -5,12 +5,19 @@ import logging
 import os
 import signal
 import sys
+import uuid
 
-import keystoneauth1.loading as ksloading
-
+from os_nova_servertester.cache import ResolutionCache, UserdataCache
 from os_nova_servertester.errors import TesterError
+from os_nova_servertester.journal import JournalState, default_journal_dir
 from os_nova_servertester.log import set_debug, setup_logging
-from os_nova_servertester.tests import SimpleTest
+from os_nova_servertester.server import userdata
+from os_nova_servertester.slo import (SLO_BREACH_EXIT, History, Objective,
+                                      check_run)
+from os_nova_servertester.trace import ApiTracer
+
+# The test modes, metrics and the client stack are imported where they are
+# used, so that --help and the offline commands stay quick
 
 LOG = logging.getLogger('tester')
 
@@ -26,8 +33,16 @@ signal.signal(signal.SIGTERM, sigterm)
 
 def main():
     setup_logging()
+    if sys.argv[1:2] == ['render-userdata']:
+        return render_userdata_main(sys.argv[2:])
+    if sys.argv[1:2] == ['reap']:
+        return reap_main(sys.argv[2:])
     parser = argparse.ArgumentParser(
-        description='Tool to test Nova server provisioning')
+        description='Tool to test Nova server provisioning',
+        epilog='Keystone authentication and session options (--os-*) are ' + \
+               'listed by --help-auth. Run "%(prog)s render-userdata ' + \
+               '--help" to render userdata offline and "%(prog)s reap ' + \
+               '--help" to clean up after killed runs.')
     parser.add_argument(
         '--image-id',
         metavar='UUID',
@@ -54,6 +69,54 @@ def main():
         metavar='PATH',
         default=os.environ.get('TEST_CONSOLE_LOGS'),
         help='Save console logs to this dir')
+    parser.add_argument(
+        '--console-log-concurrency',
+        metavar='NUM',
+        type=int,
+        default=os.environ.get('TEST_CONSOLE_LOG_CONCURRENCY', 1),
+        help='How many console logs to fetch in parallel')
+    parser.add_argument(
+        '--console-log-lines',
+        metavar='NUM',
+        type=int,
+        default=os.environ.get('TEST_CONSOLE_LOG_LINES'),
+        help='Only save this many last lines of each console log')
+    parser.add_argument(
+        '--console-log-compress',
+        action='store_true',
+        default=parse_bool(os.environ.get('TEST_CONSOLE_LOG_COMPRESS')),
+        help='Save console logs gzip compressed')
+    parser.add_argument(
+        '--console-tail-interval',
+        metavar='secs',
+        type=float,
+        default=os.environ.get('TEST_CONSOLE_TAIL_INTERVAL'),
+        help='While waiting for servers to call home, check their ' + \
+             'console output this often and fail them early if it ' + \
+             'matches a failure pattern')
+    parser.add_argument(
+        '--console-tail-lines',
+        metavar='NUM',
+        type=int,
+        default=os.environ.get('TEST_CONSOLE_TAIL_LINES', 50),
+        help='How many last console lines to fetch at a time')
+    parser.add_argument(
+        '--console-fail-pattern',
+        metavar='REGEX',
+        action='append',
+        help='Console output that means the server failed, may be ' + \
+             'repeated. Replaces the default patterns for kernel panics, ' + \
+             'cloud-init tracebacks and failed package installs')
+    parser.add_argument(
+        '--report-json',
+        metavar='FILE',
+        default=os.environ.get('TEST_REPORT_JSON'),
+        help='Write per-server phase timings and percentiles as JSON')
+    parser.add_argument(
+        '--report-csv',
+        metavar='FILE',
+        default=os.environ.get('TEST_REPORT_CSV'),
+        help='Write per-server phase timings and percentiles as CSV')
     parser.add_argument(
         '--availability-zone',
         metavar='NAME',
@@ -65,6 +128,24 @@ def main():
         type=int,
         default=os.environ.get('TEST_COUNT', 1),
         help='How many servers to provision for the test')
+    parser.add_argument(
+        '--create-concurrency',
+        metavar='NUM',
+        type=int,
+        default=os.environ.get('TEST_CREATE_CONCURRENCY', 1),
+        help='How many server create requests to run in parallel')
+    parser.add_argument(
+        '--multi-create',
+        action='store_true',
+        default=parse_bool(os.environ.get('TEST_MULTI_CREATE')),
+        help='Create all servers with a single multi-create request ' + \
+             '(min_count/max_count)')
+    parser.add_argument(
+        '--no-quota-waves',
+        action='store_true',
+        default=parse_bool(os.environ.get('TEST_NO_QUOTA_WAVES')),
+        help='Do not split runs that exceed the project quota into ' + \
+             'waves, create all servers at once')
     parser.add_argument(
         '--callhome-timeout',
         metavar='secs',
@@ -77,6 +158,104 @@ def main():
         type=int,
         default=os.environ.get('TEST_BUILD_TIMEOUT', 300),
         help='how long to wait for server(s) to start')
+    parser.add_argument(
+        '--poll-interval',
+        metavar='secs',
+        type=float,
+        default=os.environ.get('TEST_POLL_INTERVAL', 1),
+        help='how long to sleep between server status polling rounds ' + \
+             'when something is expected to change')
+    parser.add_argument(
+        '--poll-max-interval',
+        metavar='secs',
+        type=float,
+        default=os.environ.get('TEST_POLL_MAX_INTERVAL', 10),
+        help='upper limit for the polling interval when backing off')
+    parser.add_argument(
+        '--poll-backoff',
+        metavar='FACTOR',
+        type=float,
+        default=os.environ.get('TEST_POLL_BACKOFF', 1.5),
+        help='multiply polling interval by this for every idle round')
+    parser.add_argument(
+        '--poll-jitter',
+        metavar='FRACTION',
+        type=float,
+        default=os.environ.get('TEST_POLL_JITTER', 0.1),
+        help='randomize polling intervals by this fraction')
+    parser.add_argument(
+        '--poll-resync-interval',
+        metavar='secs',
+        type=float,
+        default=os.environ.get('TEST_POLL_RESYNC_INTERVAL', 60),
+        help='how often to list all servers instead of only the ones ' + \
+             'changed since the previous polling round')
+    parser.add_argument(
+        '--expected-build-time',
+        metavar='secs',
+        type=float,
+        default=os.environ.get('TEST_EXPECTED_BUILD_TIME'),
+        help='hint for how long servers usually take to go ACTIVE, ' + \
+             'polling is sparse before that')
+    parser.add_argument(
+        '--expected-callhome-time',
+        metavar='secs',
+        type=float,
+        default=os.environ.get('TEST_EXPECTED_CALLHOME_TIME'),
+        help='hint for how long servers usually take to call home')
+    parser.add_argument(
+        '--api-rate-limit',
+        metavar='REQS',
+        type=float,
+        default=os.environ.get('TEST_API_RATE_LIMIT', 0),
+        help='maximum API requests per second, 0 for unlimited')
+    parser.add_argument(
+        '--pipeline',
+        action='store_true',
+        default=parse_bool(os.environ.get('TEST_PIPELINE')),
+        help='Let each server advance thru build, callhome and teardown ' + \
+             'on its own instead of waiting for all servers at every step')
+    parser.add_argument(
+        '--delete-concurrency',
+        metavar='NUM',
+        type=int,
+        default=os.environ.get('TEST_DELETE_CONCURRENCY', 1),
+        help='How many server delete requests to run in parallel')
+    parser.add_argument(
+        '--wait-for-delete',
+        action='store_true',
+        default=parse_bool(os.environ.get('TEST_WAIT_FOR_DELETE')),
+        help='Wait until deleted servers are really gone before exiting')
+    parser.add_argument(
+        '--delete-timeout',
+        metavar='secs',
+        type=int,
+        default=os.environ.get('TEST_DELETE_TIMEOUT', 300),
+        help='how long to wait for server(s) to be deleted')
+    parser.add_argument(
+        '--callhome-mode',
+        choices=['metadata', 'push'],
+        default=os.environ.get('TEST_CALLHOME_MODE', 'metadata'),
+        help='How servers report test results: thru nova metadata or by ' + \
+             'pushing them to a listener run by this tool')
+    parser.add_argument(
+        '--callhome-listen',
+        metavar='HOST:PORT',
+        default=os.environ.get('TEST_CALLHOME_LISTEN', '0.0.0.0:0'),
+        help='Address for the push callhome listener')
+    parser.add_argument(
+        '--callhome-url',
+        metavar='URL',
+        default=os.environ.get('TEST_CALLHOME_URL'),
+        help='URL servers use to reach the push callhome listener. ' + \
+             'Guessed from the listen address if not given')
+    parser.add_argument(
+        '--callhome-fallback-interval',
+        metavar='secs',
+        type=int,
+        default=os.environ.get('TEST_CALLHOME_FALLBACK_INTERVAL', 30),
+        help='In push mode, how often to check nova metadata for servers ' + \
+             'that could not reach the listener')
     parser.add_argument(
         '--shim-type',
         choices=['bash', 'powershell'],
@@ -87,45 +266,571 @@ def main():
         choices=['cloud-init', 'cloudbase-init'],
         default=os.environ.get('TEST_CLOUD_INIT_TYPE', 'cloud-init'),
         help='What style cloud-init to use')
+    parser.add_argument(
+        '--compress-userdata',
+        action='store_true',
+        default=parse_bool(os.environ.get('TEST_COMPRESS_USERDATA')),
+        help='Gzip the cloud-init userdata to stay within the nova ' + \
+             'userdata size limit')
+    parser.add_argument(
+        '--userdata-cache',
+        action='store_true',
+        default=parse_bool(os.environ.get('TEST_USERDATA_CACHE')),
+        help='Cache rendered userdata in the user cache dir. The ' + \
+             'userdata embeds the auth token so this only helps when ' + \
+             'the token is reused between runs')
+    parser.add_argument(
+        '--resolve-cache',
+        metavar='FILE',
+        default=os.environ.get('TEST_RESOLVE_CACHE'),
+        help='File to cache flavor lookups in. ' + \
+             'Defaults to a file in the user cache dir')
+    parser.add_argument(
+        '--resolve-cache-ttl',
+        metavar='secs',
+        type=int,
+        default=os.environ.get('TEST_RESOLVE_CACHE_TTL', 3600),
+        help='How long cached lookups are trusted')
+    parser.add_argument(
+        '--no-resolve-cache',
+        action='store_true',
+        default=parse_bool(os.environ.get('TEST_NO_RESOLVE_CACHE')),
+        help='Always look up the flavor from the API')
+    parser.add_argument(
+        '--matrix',
+        metavar='FILE',
+        default=os.environ.get('TEST_MATRIX'),
+        help='Run the image/flavor/az scenarios listed in this YAML file ' + \
+             'concurrently instead of a single test')
+    parser.add_argument(
+        '--matrix-concurrency',
+        metavar='NUM',
+        type=int,
+        default=os.environ.get('TEST_MATRIX_CONCURRENCY', 4),
+        help='How many matrix scenarios to run at the same time')
+    parser.add_argument(
+        '--clouds',
+        metavar='CLOUD[:REGION],...',
+        default=os.environ.get('TEST_CLOUDS'),
+        help='Run the test against each of these clouds.yaml entries ' + \
+             'at the same time, each in a process of its own. Needs ' + \
+             'openstacksdk')
+    parser.add_argument(
+        '--clouds-concurrency',
+        metavar='NUM',
+        type=int,
+        default=os.environ.get('TEST_CLOUDS_CONCURRENCY'),
+        help='How many clouds to test at the same time, all by default')
+    parser.add_argument(
+        '--clouds-timeout',
+        metavar='secs',
+        type=int,
+        default=os.environ.get('TEST_CLOUDS_TIMEOUT'),
+        help='Stop and clean up the test of a cloud that takes longer')
+    parser.add_argument(
+        '--soak-rate',
+        metavar='PER_MIN',
+        type=float,
+        default=os.environ.get('TEST_SOAK_RATE'),
+        help='Run a soak test that keeps creating this many servers ' + \
+             'per minute and recycles each one once it has called home')
+    parser.add_argument(
+        '--soak-max-inflight',
+        metavar='NUM',
+        type=int,
+        default=os.environ.get('TEST_SOAK_MAX_INFLIGHT', 50),
+        help='Maximum number of soak test servers in progress at once')
+    parser.add_argument(
+        '--soak-duration',
+        metavar='secs',
+        type=int,
+        default=os.environ.get('TEST_SOAK_DURATION'),
+        help='How long to run the soak test, forever if not given')
+    parser.add_argument(
+        '--soak-report-interval',
+        metavar='secs',
+        type=int,
+        default=os.environ.get('TEST_SOAK_REPORT_INTERVAL', 60),
+        help='How often to log soak test success rate and latencies')
+    parser.add_argument(
+        '--soak-window',
+        metavar='secs',
+        type=int,
+        default=os.environ.get('TEST_SOAK_WINDOW', 300),
+        help='Length of the rolling window for soak test statistics')
+    parser.add_argument(
+        '--warm-pool',
+        metavar='NAME',
+        default=os.environ.get('TEST_WARM_POOL'),
+        help='Keep servers that passed in this pool and rebuild them ' + \
+             'on the next run instead of creating new ones')
+    parser.add_argument(
+        '--warm-pool-size',
+        metavar='NUM',
+        type=int,
+        default=os.environ.get('TEST_WARM_POOL_SIZE'),
+        help='Maximum number of servers kept in the warm pool, ' + \
+             'defaults to the server count')
+    parser.add_argument(
+        '--warm-pool-idle-expiry',
+        metavar='secs',
+        type=int,
+        default=os.environ.get('TEST_WARM_POOL_IDLE_EXPIRY', 3600),
+        help='Delete warm pool servers not used for this long')
+    parser.add_argument(
+        '--metrics-listen',
+        metavar='HOST:PORT',
+        default=os.environ.get('TEST_METRICS_LISTEN'),
+        help='Serve Prometheus metrics of the run at ' + \
+             'http://HOST:PORT/metrics')
+    parser.add_argument(
+        '--slo',
+        metavar='PHASE.STAT<=LIMIT',
+        action='append',
+        help='Latency objective, for example build.p95<=90 for seconds or ' + \
+             'total.p50<=+25%% for the increase over the median of the ' + \
+             'history. May be repeated. A passed run that misses one ' + \
+             'exits with {}'.format(SLO_BREACH_EXIT))
+    parser.add_argument(
+        '--history',
+        metavar='FILE',
+        default=os.environ.get('TEST_HISTORY'),
+        help='Record the phase statistics of passed runs that met all ' + \
+             'objectives to this JSON lines file, which relative ' + \
+             'objectives are compared to')
+    parser.add_argument(
+        '--history-days',
+        metavar='DAYS',
+        type=float,
+        default=os.environ.get('TEST_HISTORY_DAYS', 7),
+        help='How many days of history relative objectives use')
+    parser.add_argument(
+        '--trace',
+        metavar='FILE',
+        default=os.environ.get('TEST_TRACE'),
+        help='Record every API request and write them to FILE as a ' + \
+             'Chrome trace, or as JSON lines if FILE ends in .jsonl')
     parser.add_argument(
         '--no-cleanup-on-error',
         action='store_true',
         default=parse_bool(os.environ.get('TEST_NO_CLEANUP_ON_ERROR')),
         help='Do not delete instances on workflow failure')
 
-    ksloading.register_auth_argparse_arguments(parser, sys.argv)
-    ksloading.session.register_argparse_arguments(parser)
+    parser.add_argument(
+        '--journal-dir',
+        metavar='PATH',
+        default=os.environ.get('TEST_JOURNAL_DIR', default_journal_dir()),
+        help='Directory for the run journals used by reap and --resume')
+    parser.add_argument(
+        '--no-journal',
+        action='store_true',
+        default=parse_bool(os.environ.get('TEST_NO_JOURNAL')),
+        help='Do not keep a journal of the run')
+    parser.add_argument(
+        '--resume',
+        metavar='JOURNAL',
+        default=os.environ.get('TEST_RESUME'),
+        help='Continue an interrupted run from its journal instead of ' + \
+             'creating new servers')
+    args = parse_args(parser, sys.argv[1:])
+    # Workers of other processes cannot add to the trace
+    if args.trace and args.clouds:
+        parser.error('--trace cannot be used with --clouds')
 
-    args = parser.parse_args()
+    args.metrics = None
+    metrics_server = None
+    if args.metrics_listen:
+        from os_nova_servertester.metrics import MetricsServer, TesterMetrics
+        args.metrics = TesterMetrics()
+        metrics_server = MetricsServer(args.metrics, args.metrics_listen)
+        metrics_server.start()
+    args.tracer = ApiTracer() if args.trace else None
+    if args.slo is None and os.environ.get('TEST_SLO'):
+        args.slo = os.environ['TEST_SLO'].split(',')
 
     try:
+        args.objectives = [Objective(x) for x in args.slo or []]
+        if any(x.relative for x in args.objectives) and not args.history:
+            raise TesterError('relative objectives need --history')
+        if args.matrix:
+            return run_matrix(args)
+        if args.clouds:
+            return run_fanout(args)
+        if args.objectives and args.soak_rate:
+            raise TesterError('soak tests cannot be checked against '
+                              'objectives')
+        resume = None
+        if args.resume:
+            if args.soak_rate or args.warm_pool:
+                raise TesterError('only plain tests can be resumed')
+            resume = JournalState(args.resume)
+            if resume.is_running():
+                raise TesterError('run {} is still running'.format(
+                    resume.run_id))
+            args.image_id = args.image_id or resume.params.get('image')
+            args.flavor = args.flavor or resume.params.get('flavor')
         if args.flavor is None or args.image_id is None:
             raise TesterError('flavor and image id are required')
 
-        auth = ksloading.cli.load_from_argparse_arguments(args)
-        SimpleTest(
-            auth,
-            args.image_id,
-            args.flavor,
-            count=args.count,
-            network=args.network,
-            az=args.availability_zone,
-            test_script=args.test_script,
-            console_logs=args.console_logs,
-            build_timeout=args.build_timeout,
-            callhome_timeout=args.callhome_timeout,
-            shim_type=args.shim_type,
-            cloud_init_type=args.cloud_init_type,
-            no_cleanup_on_error=args.no_cleanup_on_error).begin()
+        auth = load_auth(args)
+        resolve_cache = None
+        if not args.no_resolve_cache:
+            resolve_cache = ResolutionCache(args.resolve_cache,
+                                            args.resolve_cache_ttl)
+        userdata_cache = None
+        if args.userdata_cache:
+            userdata_cache = UserdataCache()
+        if args.soak_rate:
+            from os_nova_servertester.soak import SoakTest
+            SoakTest(
+                auth,
+                args.image_id,
+                args.flavor,
+                rate=args.soak_rate,
+                max_inflight=args.soak_max_inflight,
+                duration=args.soak_duration,
+                report_interval=args.soak_report_interval,
+                window=args.soak_window,
+                resolve_cache=resolve_cache,
+                userdata_cache=userdata_cache,
+                **test_kwargs(args)).begin()
+        else:
+            if args.warm_pool:
+                from os_nova_servertester.warmpool import WarmPoolTest
+                test = WarmPoolTest(
+                    auth,
+                    args.image_id,
+                    args.flavor,
+                    pool=args.warm_pool,
+                    pool_size=args.warm_pool_size,
+                    idle_expiry=args.warm_pool_idle_expiry,
+                    resolve_cache=resolve_cache,
+                    userdata_cache=userdata_cache,
+                    **test_kwargs(args))
+            else:
+                from os_nova_servertester.tests import SimpleTest
+                test = SimpleTest(
+                    auth,
+                    args.image_id,
+                    args.flavor,
+                    resolve_cache=resolve_cache,
+                    userdata_cache=userdata_cache,
+                    resume=resume,
+                    **test_kwargs(args))
+            test.begin()
+            if check_run(test, args.objectives,
+                         History(args.history) if args.history else None,
+                         args.history_days):
+                return SLO_BREACH_EXIT
     except TesterError as e:
         print('ERROR: {}'.format(e), file=sys.stderr)
         return 1
     except KeyboardInterrupt:
         print('User interrupt')
         return 1
+    finally:
+        if metrics_server is not None:
+            metrics_server.stop()
+        if args.tracer is not None:
+            args.tracer.log_summary()
+            args.tracer.write(args.trace)
     return 0
 
 
+def parse_args(parser, argv):
+    '''Parse argv with the keystoneauth options added to parser'''
+    parser.add_argument(
+        '--help-auth',
+        action='help',
+        help='Show this help including the authentication options')
+    # Help and usage errors are handled before the slow to import client
+    # stack is loaded. The auth options are only known after that.
+    if '--help-auth' not in argv:
+        parser.parse_known_args(argv)
+    import keystoneauth1.loading as ksloading
+    ksloading.register_auth_argparse_arguments(parser, argv)
+    ksloading.session.register_argparse_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def load_auth(args):
+    import keystoneauth1.loading as ksloading
+    return ksloading.cli.load_from_argparse_arguments(args)
+
+
+def reap_main(argv):
+    '''Delete servers left behind by tester runs that did not clean up'''
+    parser = argparse.ArgumentParser(
+        prog='{} reap'.format(os.path.basename(sys.argv[0])),
+        description=reap_main.__doc__)
+    parser.add_argument(
+        '--journal-dir',
+        metavar='PATH',
+        default=os.environ.get('TEST_JOURNAL_DIR', default_journal_dir()),
+        help='Reap the runs journaled in this directory')
+    parser.add_argument(
+        '--journal',
+        metavar='FILE',
+        action='append',
+        help='Only reap the run of this journal, may be repeated')
+    parser.add_argument(
+        '--by-name',
+        action='store_true',
+        help='Also reap tester servers found by their name and metadata')
+    parser.add_argument(
+        '--older-than',
+        metavar='secs',
+        type=int,
+        default=3600,
+        help='With --by-name, only reap servers at least this old')
+    parser.add_argument(
+        '--concurrency',
+        metavar='NUM',
+        type=int,
+        default=8,
+        help='How many servers to delete in parallel')
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Reap runs that look like they are still running')
+    parser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='Only show what would be deleted')
+    args = parse_args(parser, argv)
+    from os_nova_servertester.reaper import Reaper
+    from os_nova_servertester.tests import make_client, pool_size_for
+
+    try:
+        reaper = Reaper(
+            make_client(load_auth(args), args.timeout or 60,
+                        pool_size_for(args.concurrency)),
+            concurrency=args.concurrency,
+            older_than=args.older_than,
+            dry_run=args.dry_run)
+        errors = reaper.reap_journals(args.journal, args.journal_dir,
+                                      args.force)
+        if args.by_name:
+            errors += reaper.delete(reaper.by_convention())
+    except TesterError as e:
+        print('ERROR: {}'.format(e), file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        print('User interrupt')
+        return 1
+    return 1 if errors else 0
+
+
+def render_userdata_main(argv):
+    '''Render and validate userdata without contacting the cloud'''
+    parser = argparse.ArgumentParser(
+        prog='{} render-userdata'.format(os.path.basename(sys.argv[0])),
+        description=render_userdata_main.__doc__)
+    parser.add_argument(
+        '--test-script',
+        metavar='FILE',
+        default=os.environ.get('TEST_TEST_SCRIPT'),
+        help='Optional test script to deploy to server(s)')
+    parser.add_argument(
+        '--shim-type',
+        choices=['bash', 'powershell'],
+        default=os.environ.get('TEST_SHIM_SCRIPT_TYPE', 'bash'),
+        help='What style of shim script to use')
+    parser.add_argument(
+        '--cloud-init-type',
+        choices=['cloud-init', 'cloudbase-init'],
+        default=os.environ.get('TEST_CLOUD_INIT_TYPE', 'cloud-init'),
+        help='What style cloud-init to use')
+    parser.add_argument(
+        '--compress-userdata',
+        action='store_true',
+        default=parse_bool(os.environ.get('TEST_COMPRESS_USERDATA')),
+        help='Gzip the cloud-init userdata')
+    parser.add_argument(
+        '--callhome-url',
+        metavar='URL',
+        default=os.environ.get('TEST_CALLHOME_URL'),
+        help='Render the shim for push callhome to this URL')
+    parser.add_argument(
+        '--token',
+        default='OS_AUTH_TOKEN',
+        help='Value to embed as the auth token')
+    parser.add_argument(
+        '--nova-endpoint',
+        metavar='URL',
+        default='NOVA_ENDPOINT',
+        help='Value to embed as the Nova endpoint')
+    parser.add_argument(
+        '--output',
+        metavar='FILE',
+        help='Write the userdata to FILE instead of stdout')
+    args = parser.parse_args(argv)
+
+    try:
+        test_script_content = ''
+        if args.test_script:
+            with open(args.test_script) as f:
+                test_script_content = f.read()
+        if args.compress_userdata and args.cloud_init_type != 'cloud-init':
+            raise TesterError(
+                'userdata compression is only supported with cloud-init')
+        rendered = userdata.render(
+            args.token,
+            args.nova_endpoint,
+            test_script_content=test_script_content,
+            shim_type=args.shim_type,
+            cloud_init_type=args.cloud_init_type,
+            compress=args.compress_userdata,
+            callhome_url=args.callhome_url,
+            callhome_token='CALLHOME_TOKEN' if args.callhome_url else '')
+        userdata.validate(rendered)
+        raw, encoded = userdata.check_size(rendered)
+    except (TesterError, IOError) as e:
+        print('ERROR: {}'.format(e), file=sys.stderr)
+        return 1
+    LOG.info('Userdata: %d bytes, %d bytes encoded (limit %d)',
+             raw, encoded, userdata.USERDATA_LIMIT)
+    if isinstance(rendered, bytes):
+        data = rendered
+    else:
+        data = rendered.encode('utf-8')
+    if args.output:
+        with open(args.output, 'wb') as f:
+            f.write(data)
+    else:
+        getattr(sys.stdout, 'buffer', sys.stdout).write(data)
+    return 0
+
+
+def test_kwargs(args):
+    '''SimpleTest keyword arguments common to all modes'''
+    return dict(
+        count=args.count,
+        network=args.network,
+        az=args.availability_zone,
+        test_script=args.test_script,
+        console_logs=args.console_logs,
+        console_log_concurrency=args.console_log_concurrency,
+        console_log_lines=args.console_log_lines,
+        console_log_compress=args.console_log_compress,
+        console_tail_interval=args.console_tail_interval,
+        console_tail_lines=args.console_tail_lines,
+        console_fail_patterns=args.console_fail_pattern,
+        compress_userdata=args.compress_userdata,
+        journal_dir=None if args.no_journal else args.journal_dir,
+        metrics=args.metrics,
+        tracer=args.tracer,
+        report_json=args.report_json,
+        report_csv=args.report_csv,
+        build_timeout=args.build_timeout,
+        callhome_timeout=args.callhome_timeout,
+        poll_interval=args.poll_interval,
+        poll_max_interval=args.poll_max_interval,
+        poll_backoff=args.poll_backoff,
+        poll_jitter=args.poll_jitter,
+        poll_resync_interval=args.poll_resync_interval,
+        expected_build_time=args.expected_build_time,
+        expected_callhome_time=args.expected_callhome_time,
+        api_rate_limit=args.api_rate_limit,
+        create_concurrency=args.create_concurrency,
+        multi_create=args.multi_create,
+        quota_waves=not args.no_quota_waves,
+        callhome_mode=args.callhome_mode,
+        callhome_listen=args.callhome_listen,
+        callhome_url=args.callhome_url,
+        callhome_fallback_interval=args.callhome_fallback_interval,
+        pipeline=args.pipeline,
+        delete_concurrency=args.delete_concurrency,
+        wait_for_delete=args.wait_for_delete,
+        delete_timeout=args.delete_timeout,
+        shim_type=args.shim_type,
+        cloud_init_type=args.cloud_init_type,
+        no_cleanup_on_error=args.no_cleanup_on_error)
+
+
+def run_matrix(args):
+    from os_nova_servertester.matrix import MatrixRunner, load_scenarios
+    from os_nova_servertester.poll import RateLimiter
+    from os_nova_servertester.server.callhome import CallhomeReceiver
+    from os_nova_servertester.tests import (SimpleTest, make_client,
+                                            pool_size_for)
+
+    scenarios = load_scenarios(args.matrix)
+    auth = load_auth(args)
+    kwargs = test_kwargs(args)
+    # Per-scenario reports would overwrite each other
+    kwargs.update(report_json=None, report_csv=None)
+    # All scenarios share the client and so its connection pool
+    pool_size = args.matrix_concurrency * pool_size_for(
+        args.create_concurrency, args.delete_concurrency,
+        args.console_log_concurrency)
+    client = make_client(auth, pool_size=pool_size, tracer=args.tracer)
+    if args.metrics is not None:
+        args.metrics.add_connection_stats(client.connection_stats)
+    callhome = None
+    if args.callhome_mode == 'push':
+        callhome = CallhomeReceiver(args.callhome_listen, args.callhome_url,
+                                    uuid.uuid4().hex)
+        callhome.start(client.client.get_endpoint())
+    runner = MatrixRunner(
+        SimpleTest,
+        auth,
+        scenarios,
+        concurrency=args.matrix_concurrency,
+        objectives=args.objectives,
+        history=History(args.history) if args.history else None,
+        history_days=args.history_days,
+        client=client,
+        rate_limiter=RateLimiter(args.api_rate_limit),
+        callhome=callhome,
+        userdata_cache=UserdataCache(persist=args.userdata_cache),
+        resolve_cache=ResolutionCache(
+            args.resolve_cache,
+            args.resolve_cache_ttl,
+            persist=not args.no_resolve_cache),
+        **kwargs)
+    try:
+        ok = runner.run()
+    finally:
+        if callhome is not None:
+            callhome.stop()
+        client.connection_stats.log_summary()
+    runner.print_table()
+    if not ok:
+        return 1
+    return SLO_BREACH_EXIT if runner.breached else 0
+
+
+def run_fanout(args):
+    from os_nova_servertester.fanout import FanoutRunner
+
+    if args.flavor is None or args.image_id is None:
+        raise TesterError('flavor and image id are required')
+    kwargs = test_kwargs(args)
+    # Per-cloud reports would overwrite each other, and metrics cannot be
+    # shared between processes
+    kwargs.update(report_json=None, report_csv=None, metrics=None)
+    resolve_cache = None
+    if not args.no_resolve_cache:
+        resolve_cache = (args.resolve_cache, args.resolve_cache_ttl)
+    runner = FanoutRunner(
+        [x.strip() for x in args.clouds.split(',') if x.strip()],
+        args.image_id,
+        args.flavor,
+        concurrency=args.clouds_concurrency,
+        timeout=args.clouds_timeout,
+        resolve_cache=resolve_cache,
+        objectives=args.slo or [],
+        history=args.history,
+        history_days=args.history_days,
+        **kwargs)
+    ok = runner.run()
+    runner.print_table()
+    if not ok:
+        return 1
+    return SLO_BREACH_EXIT if runner.breached else 0
+
+
 def parse_bool(val):
     if val and val.lower() in ['true', 't', '1']:
         return True
@@ -0,0 +1,119 @@
+'''Shared, counted HTTP connection pools for the API clients
+
+Imported only when a real client is made, it pulls in requests.
+'''
+from __future__ import print_function, unicode_literals
+
+import logging
+import threading
+import time
+
+import requests
+from keystoneauth1 import session as ks_session
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+LOG = logging.getLogger(__name__)
+
+# Adapter keystoneauth mounts itself, keeps TCP keep-alive probes on
+BaseAdapter = getattr(ks_session, 'TCPKeepAliveAdapter',
+                      requests.adapters.HTTPAdapter)
+
+
+class ConnectionStats(object):
+    '''Counts requests and the connections opened to serve them'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+
+    def add_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def add_connection(self):
+        with self.lock:
+            self.connections += 1
+
+    @property
+    def reused(self):
+        '''Requests served on an already open connection'''
+        return max(self.requests - self.connections, 0)
+
+    def log_summary(self):
+        LOG.info('HTTP: %d requests, %d new connections, %d reused',
+                 self.requests, self.connections, self.reused)
+
+
+def _counting_pool(base, stats):
+    def _new_conn(self):
+        stats.add_connection()
+        return base._new_conn(self)
+    return type(str('Counting' + base.__name__), (base,),
+                dict(_new_conn=_new_conn))
+
+
+class CountingAdapter(BaseAdapter):
+    '''HTTP adapter that counts new connections and requests'''
+
+    def __init__(self, stats, **kwargs):
+        self.stats = stats
+        super(CountingAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(CountingAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _counting_pool(HTTPConnectionPool, self.stats),
+            'https': _counting_pool(HTTPSConnectionPool, self.stats),
+        }
+
+    def send(self, request, *args, **kwargs):
+        self.stats.add_request()
+        return super(CountingAdapter, self).send(request, *args, **kwargs)
+
+
+class TracingSession(ks_session.Session):
+    '''keystoneauth Session that records every request to a tracer
+
+    This includes the requests to Keystone made for authentication.
+    '''
+
+    def __init__(self, tracer, **kwargs):
+        self.tracer = tracer
+        super(TracingSession, self).__init__(**kwargs)
+
+    def request(self, url, method, **kwargs):
+        start = time.time()
+        try:
+            resp = super(TracingSession, self).request(url, method, **kwargs)
+        except Exception as e:
+            # HTTP errors are raised, with the response if there was one
+            resp = getattr(e, 'response', None)
+            self.tracer.record(
+                method, getattr(resp, 'url', None) or url,
+                getattr(e, 'http_status', None) or e.__class__.__name__,
+                len(getattr(resp, 'content', None) or b''), start,
+                time.time() - start)
+            raise
+        self.tracer.record(method, resp.url, resp.status_code,
+                           len(resp.content or b''), start,
+                           time.time() - start)
+        return resp
+
+
+def make_session(auth, pool_size=10, tracer=None):
+    '''keystoneauth Session whose connection pool fits pool_size threads
+
+    Compute, image and network calls all go thru the one requests session,
+    so connections to an endpoint are kept open and reused by any of them.
+    With a tracer every request is recorded to it. Returns the session and
+    its ConnectionStats.
+    '''
+    stats = ConnectionStats()
+    http = requests.Session()
+    adapter = CountingAdapter(stats, pool_maxsize=pool_size)
+    for scheme in ('https://', 'http://'):
+        http.mount(scheme, adapter)
+    if tracer is not None:
+        return TracingSession(tracer, auth=auth, session=http), stats
+    return ks_session.Session(auth=auth, session=http), stats
@@ -0,0 +1,53 @@
+from __future__ import print_function, unicode_literals
+
+import re
+
+# Console output of guests that are not going to call home
+DEFAULT_FAIL_PATTERNS = (
+    r'Kernel panic - not syncing',
+    r'cloud-init.*Traceback \(most recent call last\)',
+    r'Failed to install packages',
+    r'Failed running /var/lib/cloud/instance/scripts/',
+    r'curl: (command )?not found',
+)
+
+
+class ConsoleTail(object):
+    '''Tells apart the new lines of a console output tail
+
+    Nova only returns the last lines of the console, so each fetched tail
+    is lined up against the previous one by their overlap. If there is
+    none, more was written than fits in a tail and all of it is new.
+    '''
+
+    def __init__(self):
+        self.last = []
+
+    def new_lines(self, output):
+        lines = output.splitlines()
+        start = 0
+        for k in range(min(len(lines), len(self.last)), 0, -1):
+            if lines[:k] == self.last[-k:]:
+                start = k
+                break
+        self.last = lines
+        return lines[start:]
+
+
+class ConsoleWatcher(object):
+    '''Matches new console output of servers against failure patterns'''
+
+    def __init__(self, patterns=DEFAULT_FAIL_PATTERNS):
+        self.patterns = [re.compile(x) for x in patterns]
+        self.tails = {}
+
+    def check(self, server_id, output):
+        '''Returns the first new line matching a pattern, None if none'''
+        tail = self.tails.setdefault(server_id, ConsoleTail())
+        for line in tail.new_lines(output or ''):
+            if any(x.search(line) for x in self.patterns):
+                return line.strip()
+        return None
+
+    def forget(self, server_id):
+        self.tails.pop(server_id, None)
@@ -0,0 +1,399 @@
+'''In-process stand-in for the parts of OpenStack that SimpleTest talks to
+
+FakeClient mimics the novaclient Client interface used by the tester
+(servers, flavors, glance, neutron and the low level client's token
+and endpoint) so that whole workflows can be run and benchmarked
+without a cloud. Servers build, call home and get deleted
+on configurable delays, a fraction of them can fail, and the API can
+enforce a request rate limit with 429 responses.
+'''
+from __future__ import print_function, unicode_literals
+
+import random
+import re
+import threading
+import time
+import uuid
+
+from novaclient import exceptions as nova_exceptions
+
+RateLimitError = getattr(nova_exceptions, 'RateLimit',
+                         nova_exceptions.OverLimit)
+
+
+class FakeResource(object):
+    def __init__(self, **kwargs):
+        self.id = str(uuid.uuid4())
+        self.__dict__.update(kwargs)
+
+
+def isotime(t):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(t))
+
+
+class FakeServer(object):
+    def __init__(self, manager, name, image=None, flavor=None, meta=None):
+        self.manager = manager
+        self.id = str(uuid.uuid4())
+        self.name = name
+        self.image = image
+        self.flavor = flavor
+        self.status = 'BUILD'
+        self.metadata = dict(meta or {})
+        self.created_at = time.time()
+        self.created = isotime(self.created_at)
+        self.updated = self.created
+        self.deleted_at = None
+        self.will_fail = False
+        self.will_report_error = False
+        self.will_panic = False
+        self.console = []
+
+    def snapshot(self):
+        '''Copy of the server as a list or get call would return it'''
+        ret = FakeServer.__new__(FakeServer)
+        ret.__dict__.update(self.__dict__)
+        ret.metadata = dict(self.metadata)
+        ret.console = list(self.console)
+        if self.status == 'ERROR':
+            ret.fault = {'message': 'fake build failure'}
+        return ret
+
+    def get_console_output(self, length=None):
+        return self.manager.get_console_output(self, length)
+
+
+class FakeServerManager(object):
+    '''In-memory stand-in for novaclient's ServerManager
+
+    Servers go ACTIVE ``build_delay`` seconds after creation and report
+    completion thru metadata ``callhome_delay`` seconds after that. Deleted
+    servers stay listed for ``delete_delay`` seconds. A ``panic_rate``
+    share of servers print a kernel panic when they go ACTIVE and never
+    report. A list call returns at most ``page_size`` servers.
+    '''
+
+    def __init__(self, client, build_delay=0, callhome_delay=0,
+                 delete_delay=0, build_error_rate=0, callhome_error_rate=0,
+                 panic_rate=0, page_size=1000,
+                 status_key='SimpleTestStatus', status_complete='complete',
+                 status_error='error', exitcode_key='SimpleTestExitStatus',
+                 timings_key='SimpleTestTimings'):
+        self.client = client
+        self.build_delay = build_delay
+        self.callhome_delay = callhome_delay
+        self.delete_delay = delete_delay
+        self.build_error_rate = build_error_rate
+        self.callhome_error_rate = callhome_error_rate
+        self.panic_rate = panic_rate
+        # Nova's osapi_max_limit, the most servers a list call returns
+        self.page_size = page_size
+        self.status_key = status_key
+        self.status_complete = status_complete
+        self.status_error = status_error
+        self.exitcode_key = exitcode_key
+        self.timings_key = timings_key
+        self.servers = {}
+        # Creation order of all servers, which list pages follow
+        self.order = {}
+        self.lock = threading.Lock()
+
+    def _refresh(self, server):
+        now = time.time()
+        age = now - server.created_at
+        if server.deleted_at is not None:
+            if now - server.deleted_at >= self.delete_delay:
+                del self.servers[server.id]
+                return None
+        elif (server.status in ('BUILD', 'REBUILD') and
+              age >= self.build_delay):
+            server.status = 'ERROR' if server.will_fail else 'ACTIVE'
+            server.updated = isotime(now)
+            server.console.append('fake boot {}'.format(server.status))
+            if server.will_panic and server.status == 'ACTIVE':
+                server.console.append(
+                    'Kernel panic - not syncing: fake panic')
+        elif (server.status == 'ACTIVE' and not server.will_panic and
+              self.status_key in server.metadata and
+              age >= self.build_delay + self.callhome_delay):
+            # Like the shim, report everything in one update. As in Nova,
+            # metadata changes do not touch the update time.
+            server.metadata[self.timings_key] = 'uptime={:.1f},script={:.1f}'.format(
+                self.callhome_delay / 2.0, self.callhome_delay / 4.0)
+            if server.will_report_error:
+                server.metadata[self.exitcode_key] = '1'
+                server.metadata[self.status_key] = self.status_error
+            else:
+                server.metadata[self.exitcode_key] = '0'
+                server.metadata[self.status_key] = self.status_complete
+        return server
+
+    def _find(self, server):
+        server_id = getattr(server, 'id', server)
+        found = self.servers.get(server_id)
+        if found is None or self._refresh(found) is None:
+            raise nova_exceptions.NotFound(404, 'server not found')
+        return found
+
+    def create(self, name, image, flavor, meta=None, min_count=None,
+               max_count=None, **kwargs):
+        self.client.api_call('POST', '/servers')
+        count = max_count or 1
+        created = []
+        with self.lock:
+            self.client.limits.check(count, flavor)
+            for i in range(1, count + 1):
+                server = FakeServer(
+                    self, '{}-{}'.format(name, i) if count > 1 else name,
+                    image, flavor, meta)
+                server.will_fail = random.random() < self.build_error_rate
+                server.will_report_error = (
+                    random.random() < self.callhome_error_rate)
+                server.will_panic = random.random() < self.panic_rate
+                self.servers[server.id] = server
+                self.order[server.id] = len(self.order)
+                created.append(server)
+        return created[0].snapshot()
+
+    def rebuild(self, server, image, name=None, meta=None, userdata=None,
+                **kwargs):
+        self.client.api_call('POST', '/servers/{id}/action')
+        with self.lock:
+            found = self._find(server)
+            if found.deleted_at is not None or found.status not in (
+                    'ACTIVE', 'SHUTOFF', 'ERROR'):
+                raise nova_exceptions.Conflict(409, 'cannot rebuild')
+            found.status = 'REBUILD'
+            found.image = image
+            found.created_at = time.time()
+            found.updated = isotime(found.created_at)
+            found.metadata = dict(meta or {})
+            if name is not None:
+                found.name = name
+            found.will_fail = random.random() < self.build_error_rate
+            found.will_report_error = (
+                random.random() < self.callhome_error_rate)
+            found.will_panic = random.random() < self.panic_rate
+            return found.snapshot()
+
+    def get(self, server):
+        self.client.api_call('GET', '/servers/{id}')
+        with self.lock:
+            return self._find(server).snapshot()
+
+    def list(self, detailed=True, search_opts=None, marker=None,
+             limit=None, **kwargs):
+        '''Pages like novaclient: one page unless limit is -1'''
+        ret = []
+        while True:
+            page = self._list_page(search_opts, marker, limit)
+            ret.extend(page)
+            if not page or limit != -1:
+                return ret
+            marker = page[-1].id
+
+    def _list_page(self, search_opts, marker, limit):
+        self.client.api_call('GET', '/servers/detail')
+        name = (search_opts or {}).get('name')
+        since = (search_opts or {}).get('changes-since')
+        size = self.page_size
+        if limit is not None and limit != -1:
+            size = min(limit, size)
+        with self.lock:
+            servers = [self._refresh(x) for x in list(self.servers.values())
+                       if name is None or re.search(name, x.name)]
+            servers = [x for x in servers if x is not None and
+                       (since is None or x.updated >= since)]
+            if marker is not None:
+                # Like Nova, deleted servers still work as markers
+                if marker not in self.order:
+                    raise nova_exceptions.BadRequest(
+                        400, 'marker not found: {}'.format(marker))
+                servers = [x for x in servers
+                           if self.order[x.id] > self.order[marker]]
+            return [x.snapshot() for x in servers[:size]]
+
+    def delete(self, server):
+        self.client.api_call('DELETE', '/servers/{id}')
+        with self.lock:
+            found = self._find(server)
+            if found.deleted_at is None:
+                found.deleted_at = time.time()
+                found.updated = isotime(found.deleted_at)
+            self._refresh(found)
+
+    def get_console_output(self, server, length=None):
+        self.client.api_call('POST', '/servers/{id}/action')
+        with self.lock:
+            lines = self._find(server).console
+            if length is not None:
+                lines = lines[-int(length):]
+            return '\n'.join(lines)
+
+
+class FakeCatalog(object):
+    '''Named resources that keep their ids between lookups
+
+    Without ``find_by_id`` find only matches names, like novaclient's
+    ``flavors.find(name=...)``.
+    '''
+
+    def __init__(self, client, url, find_by_id=True, **attrs):
+        self.client = client
+        self.url = url
+        self.find_by_id = find_by_id
+        self.attrs = attrs
+        self.by_id = {}
+        self.lock = threading.Lock()
+
+    def _lookup(self, name_or_id):
+        with self.lock:
+            if name_or_id in self.by_id:
+                return self.by_id[name_or_id]
+            for resource in self.by_id.values():
+                if resource.name == name_or_id:
+                    return resource
+            resource = FakeResource(
+                name=name_or_id, label=name_or_id, **self.attrs)
+            self.by_id[resource.id] = resource
+            return resource
+
+    def find(self, name):
+        '''Lookup by name lists the whole catalog, lookup by id is a get'''
+        if name in self.by_id and self.find_by_id:
+            self.client.api_call('GET', self.url + '/{id}')
+        else:
+            self.client.api_call('GET', self.url)
+            if name in self.by_id:
+                raise nova_exceptions.NotFound(404, 'not found')
+        return self._lookup(name)
+
+    def get(self, resource_id):
+        self.client.api_call('GET', self.url + '/{id}')
+        with self.lock:
+            if resource_id not in self.by_id:
+                raise nova_exceptions.NotFound(404, 'not found')
+            return self.by_id[resource_id]
+
+    # Manager specific spellings
+    find_image = find
+    find_network = find
+
+
+class FakeLimits(object):
+    '''Absolute limits of the project, usage counted from the fake servers
+
+    A negative maximum means unlimited. Creates that do not fit fail with
+    403 like they do in Nova.
+    '''
+
+    def __init__(self, client, max_instances=-1, max_cores=-1, max_ram=-1):
+        self.client = client
+        self.maximum = dict(instances=max_instances, cores=max_cores,
+                            ram=max_ram)
+
+    def usage(self, extra=0, flavor=None):
+        manager = self.client.servers
+        servers = [x for x in map(manager._refresh,
+                                  list(manager.servers.values()))
+                   if x is not None]
+        flavors = [x.flavor for x in servers] + [flavor] * extra
+        return dict(
+            instances=len(flavors),
+            cores=sum(getattr(x, 'vcpus', 1) for x in flavors),
+            ram=sum(getattr(x, 'ram', 0) for x in flavors))
+
+    def check(self, count, flavor):
+        for name, used in self.usage(count, flavor).items():
+            if 0 <= self.maximum[name] < used:
+                raise nova_exceptions.Forbidden(
+                    403, 'Quota exceeded for {}'.format(name))
+
+    def get(self, **kwargs):
+        self.client.api_call('GET', '/limits')
+        with self.client.servers.lock:
+            used = self.usage()
+        absolute = [
+            FakeResource(name='maxTotalInstances',
+                         value=self.maximum['instances']),
+            FakeResource(name='totalInstancesUsed', value=used['instances']),
+            FakeResource(name='maxTotalCores', value=self.maximum['cores']),
+            FakeResource(name='totalCoresUsed', value=used['cores']),
+            FakeResource(name='maxTotalRAMSize', value=self.maximum['ram']),
+            FakeResource(name='totalRAMUsed', value=used['ram']),
+        ]
+        return FakeResource(absolute=absolute)
+
+
+class FakeHTTPClient(object):
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.token = uuid.uuid4().hex
+
+    def get_token(self):
+        return self.token
+
+    def get_endpoint(self):
+        return self.endpoint
+
+
+class FakeClient(object):
+    '''Fake novaclient Client
+
+    Counts calls per method and url template, simulates ``latency`` seconds
+    per call and, with a non-zero ``rate_limit``, answers calls above that
+    many per second with a 429 carrying a Retry-After of one second.
+    '''
+
+    def __init__(self, latency=0, rate_limit=0, vcpus=1, ram=512,
+                 endpoint='http://nova.fake:8774/v2.1', max_instances=-1,
+                 max_cores=-1, max_ram=-1, tracer=None, **kwargs):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.calls = {}
+        self.rate_limited = 0
+        self.tracer = tracer
+        self.window = (0, 0)
+        self.lock = threading.Lock()
+        self.client = FakeHTTPClient(endpoint)
+        self.servers = FakeServerManager(self, **kwargs)
+        self.flavors = FakeCatalog(self, '/flavors', find_by_id=False,
+                                   vcpus=vcpus, ram=ram)
+        self.glance = FakeCatalog(self, '/v2/images')
+        # Like novaclient's proxies, networks are only found by name
+        self.neutron = FakeCatalog(self, '/v2.0/networks', find_by_id=False)
+        self.limits = FakeLimits(self, max_instances, max_cores, max_ram)
+
+    def api_call(self, method, url):
+        start = time.time()
+        status = 200
+        try:
+            self._api_call(method, url)
+        except RateLimitError:
+            status = 429
+            raise
+        finally:
+            if self.tracer is not None:
+                self.tracer.record(method, self.client.endpoint + url,
+                                   status, 0, start, time.time() - start)
+
+    def _api_call(self, method, url):
+        with self.lock:
+            key = '{} {}'.format(method, url)
+            self.calls[key] = self.calls.get(key, 0) + 1
+            if self.rate_limit:
+                second = int(time.time())
+                start, count = self.window
+                if start != second:
+                    start, count = second, 0
+                self.window = (start, count + 1)
+                if count + 1 > self.rate_limit:
+                    self.rate_limited += 1
+                    raise RateLimitError(
+                        429, 'Rate limit exceeded', retry_after=1)
+        if self.latency:
+            time.sleep(self.latency)
+
+    @property
+    def total_calls(self):
+        return sum(self.calls.values())
@@ -0,0 +1,234 @@
+'''Runs the same test against many clouds or regions at once
+
+Every target runs in a process of its own with its own authentication,
+client and lookups, so a slow or hanging cloud does not hold the others
+up. Targets are clouds.yaml entries, reading them needs openstacksdk.
+'''
+from __future__ import print_function, unicode_literals
+
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import time
+
+from six.moves import queue as six_queue
+
+from os_nova_servertester.cache import ResolutionCache, UserdataCache
+from os_nova_servertester.errors import TesterError
+from os_nova_servertester.report import TimingReport, print_results
+from os_nova_servertester.slo import History, Objective, check_run
+
+LOG = logging.getLogger(__name__)
+
+# How long a terminated worker gets to clean up before it is killed
+KILL_GRACE = 120
+
+
+def parse_target(target):
+    '''cloud or cloud:region -> (cloud, region or None)'''
+    cloud, _, region = target.partition(':')
+    if not cloud:
+        raise TesterError('invalid cloud: {}'.format(target))
+    return cloud, region or None
+
+
+def target_client(target, api_timeout=60, pool_size=10):
+    '''Auth plugin and Nova client of a clouds.yaml entry'''
+    try:
+        from openstack import config as os_config
+    except ImportError:
+        raise TesterError('running against clouds needs openstacksdk')
+    from os_nova_servertester.tests import make_client
+
+    cloud, region = parse_target(target)
+    cloud_region = os_config.OpenStackConfig().get_one(
+        cloud=cloud, region_name=region)
+    auth = cloud_region.get_auth()
+    client = make_client(auth, api_timeout, pool_size,
+                         region_name=cloud_region.get_region_name('compute'))
+    return auth, client
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt('SIGTERM')
+
+
+def run_target(target, image, flavor, results, resolve_cache, slo,
+               test_kwargs):
+    '''Worker process: run the test against target and report the result'''
+    from os_nova_servertester.tests import SimpleTest, pool_size_for
+
+    # The parent terminates the workers on interrupt and on timeout, which
+    # rolls their tests back
+    signal.signal(signal.SIGTERM, _interrupt)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if not logging.getLogger().handlers:
+        from os_nova_servertester.log import setup_logging
+        setup_logging()
+    result = dict(target=target, passed=False, error=None, servers=0,
+                  stats={}, breaches=[])
+    start = time.time()
+    test = None
+    try:
+        auth, client = target_client(
+            target, test_kwargs.get('api_timeout', 60), pool_size_for(
+                test_kwargs.get('create_concurrency', 1),
+                test_kwargs.get('delete_concurrency', 1),
+                test_kwargs.get('console_log_concurrency', 1)))
+        test = SimpleTest(
+            auth, image, flavor, client=client,
+            resolve_cache=ResolutionCache(*resolve_cache)
+            if resolve_cache else None,
+            userdata_cache=UserdataCache(persist=False),
+            **test_kwargs)
+        LOG.info('Cloud %s: starting', target)
+        test.begin()
+        result['passed'] = True
+        objectives, history, days = slo
+        result['breaches'] = check_run(
+            test, [Objective(x) for x in objectives],
+            History(history) if history else None, days)
+    except KeyboardInterrupt as e:
+        result['error'] = 'interrupted: {}'.format(e)
+    except Exception as e:
+        result['error'] = '{}'.format(e) or e.__class__.__name__
+    finally:
+        result['wall'] = time.time() - start
+        if test is not None:
+            result['servers'] = len(test.tracked)
+            result['stats'] = TimingReport(test.tracked.values()).aggregate()
+        results.put(result)
+
+
+class FanoutRunner(object):
+    '''Runs a test per target in a pool of processes
+
+    Results are logged as each target finishes. A target still running
+    after timeout seconds is terminated, which makes it clean up.
+    '''
+
+    def __init__(self, targets, image, flavor, concurrency=None,
+                 timeout=None, resolve_cache=None, objectives=(),
+                 history=None, history_days=7, **test_kwargs):
+        self.targets = list(targets)
+        self.image = image
+        self.flavor = flavor
+        self.concurrency = concurrency or len(self.targets)
+        self.timeout = timeout
+        # (path, ttl) of the resolution cache, each worker opens its own
+        self.resolve_cache = resolve_cache
+        # Objective specs and history path, checked by each worker
+        self.slo = (list(objectives), history, history_days)
+        self.test_kwargs = test_kwargs
+        self.results = {}
+        # target -> when it was terminated
+        self.stopped = {}
+        self.started = None
+
+    def start(self, target, results):
+        process = multiprocessing.Process(
+            target=run_target, name=target,
+            args=(target, self.image, self.flavor, results,
+                  self.resolve_cache, self.slo, self.test_kwargs))
+        process.start()
+        return process
+
+    def finish(self, result):
+        if result['target'] in self.stopped:
+            result['error'] = 'timed out after {}s'.format(self.timeout)
+        self.results[result['target']] = result
+        LOG.info('Cloud %s: %s in %.1fs%s', result['target'],
+                 self.verdict(result), result['wall'],
+                 ': {}'.format(result['error']) if result['error'] else '')
+
+    @staticmethod
+    def verdict(result):
+        if not result['passed']:
+            return 'FAIL'
+        return 'SLO' if result['breaches'] else 'PASS'
+
+    @property
+    def breached(self):
+        '''Some cloud passed but missed a latency objective'''
+        return any(x['breaches'] for x in self.results.values())
+
+    def stop(self, target, process, now):
+        '''Terminate a worker, kill it if it does not clean up in time'''
+        if target not in self.stopped:
+            self.stopped[target] = now
+            process.terminate()
+        elif now - self.stopped[target] > KILL_GRACE:
+            LOG.error('Cloud %s: did not clean up, killing', target)
+            os.kill(process.pid, signal.SIGKILL)
+
+    def run(self):
+        '''Run all targets, returns True if all of them passed'''
+        self.started = time.time()
+        results = multiprocessing.Queue()
+        pending = list(self.targets)
+        # target -> (process, start time)
+        running = {}
+        try:
+            while pending or running:
+                while pending and len(running) < self.concurrency:
+                    target = pending.pop(0)
+                    running[target] = (self.start(target, results),
+                                       time.time())
+                try:
+                    self.finish(results.get(timeout=1))
+                except six_queue.Empty:
+                    pass
+                now = time.time()
+                for target, (process, started) in list(running.items()):
+                    if not process.is_alive():
+                        process.join()
+                        del running[target]
+                    elif self.timeout and now - started > self.timeout:
+                        if target not in self.stopped:
+                            LOG.error('Cloud %s: timed out, terminating',
+                                      target)
+                        self.stop(target, process, now)
+            # Results of the last workers to exit
+            while True:
+                try:
+                    self.finish(results.get(timeout=1))
+                except six_queue.Empty:
+                    break
+        except KeyboardInterrupt:
+            LOG.error('Interrupted, stopping %d clouds', len(running))
+            while running:
+                now = time.time()
+                for target, (process, _) in list(running.items()):
+                    if process.is_alive():
+                        self.stop(target, process, now)
+                    else:
+                        process.join()
+                        del running[target]
+                time.sleep(1)
+            raise
+        for target in self.targets:
+            if target not in self.results:
+                self.results[target] = dict(
+                    target=target, passed=False, servers=0, stats={},
+                    breaches=[],
+                    wall=time.time() - self.started,
+                    error='timed out after {}s'.format(self.timeout)
+                    if target in self.stopped else 'worker died')
+        return all(x['passed'] for x in self.results.values())
+
+    def print_table(self, out=sys.stdout):
+        rows = []
+        for target in self.targets:
+            result = self.results[target]
+            rows.append((
+                target, self.verdict(result), result['servers'],
+                result['stats'], result['wall'],
+                ([result['error']] if result['error'] else []) +
+                result['breaches']))
+        print_results('cloud', 30, rows, out)
+        slowest = max([x['wall'] for x in self.results.values()] or [0])
+        total = sum(x['wall'] for x in self.results.values())
+        print('slowest cloud {:.1f}s, all clouds one after another {:.1f}s'
+              .format(slowest, total), file=out)
@@ -0,0 +1,143 @@
+from __future__ import print_function, unicode_literals
+
+import errno
+import glob
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+from os_nova_servertester.cache import default_cache_dir
+from os_nova_servertester.errors import TesterError
+
+LOG = logging.getLogger(__name__)
+
+
+def default_journal_dir():
+    return os.path.join(default_cache_dir(), 'journals')
+
+
+class RunJournal(object):
+    '''Append-only record of the servers a run created
+
+    Every line is a JSON event: a ``run`` event with the run id, server name
+    prefix and test parameters, a ``server`` event each time a server
+    reaches a new state and a ``close`` event when the run has cleaned up.
+    Lines are flushed as they are written, so the journal survives the
+    tester being killed and can be used to reap or resume the run. A run
+    that leaves nothing behind removes its journal when it closes.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.f = None
+
+    @classmethod
+    def for_run(cls, run_id, directory=None):
+        return cls(os.path.join(directory or default_journal_dir(),
+                                'run-{}.jsonl'.format(run_id)))
+
+    def write(self, event, **kwargs):
+        kwargs.update(event=event, time=time.time())
+        line = json.dumps(kwargs, sort_keys=True) + '\n'
+        with self.lock:
+            if self.f is None:
+                dirname = os.path.dirname(os.path.abspath(self.path))
+                if not os.path.isdir(dirname):
+                    os.makedirs(dirname, 0o700)
+                self.f = open(self.path, 'a')
+            self.f.write(line)
+            self.f.flush()
+
+    def start(self, run_id, prefix, **params):
+        self.write('run', run_id=run_id, prefix=prefix, pid=os.getpid(),
+                   host=socket.gethostname(), params=params)
+
+    def server(self, server_id, state):
+        self.write('server', id=server_id, state=state)
+
+    def close(self, outcome, remove=False):
+        self.write('close', outcome=outcome)
+        with self.lock:
+            if self.f is not None:
+                self.f.close()
+                self.f = None
+            if remove:
+                try:
+                    os.remove(self.path)
+                except OSError as e:
+                    LOG.warning('Cannot remove journal %s: %s', self.path, e)
+
+
+class JournalState(object):
+    '''State of a run replayed from its journal'''
+
+    def __init__(self, path):
+        self.path = path
+        self.run_id = None
+        self.prefix = None
+        self.pid = None
+        self.host = None
+        self.params = {}
+        # server id -> last state, in creation order
+        self.servers = {}
+        self.order = []
+        self.outcome = None
+        with open(path) as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    # A torn last line from a killed writer
+                    LOG.warning('%s: skipping unreadable line', path)
+                    continue
+                self.apply(event)
+        if self.run_id is None:
+            raise TesterError('{} is not a run journal'.format(path))
+
+    def apply(self, event):
+        kind = event.get('event')
+        if kind == 'run':
+            self.run_id = event['run_id']
+            self.prefix = event['prefix']
+            self.pid = event.get('pid')
+            self.host = event.get('host')
+            self.params = event.get('params') or {}
+            # A resumed run starts over
+            self.outcome = None
+        elif kind == 'server':
+            if event['id'] not in self.servers:
+                self.order.append(event['id'])
+            self.servers[event['id']] = event['state']
+        elif kind == 'close':
+            self.outcome = event.get('outcome')
+
+    @property
+    def closed(self):
+        return self.outcome is not None
+
+    def is_running(self):
+        '''True if the process that wrote the journal is still alive'''
+        if self.closed or self.pid is None:
+            return False
+        if self.host != socket.gethostname():
+            # Cannot tell, assume it is gone if it has not written lately
+            return time.time() - os.path.getmtime(self.path) < 3600
+        try:
+            os.kill(self.pid, 0)
+        except OSError as e:
+            # EPERM means it exists but belongs to someone else
+            return e.errno == errno.EPERM
+        return True
+
+    def leftovers(self):
+        '''Ids of servers not known to be deleted, in creation order'''
+        return [x for x in self.order if self.servers[x] != 'deleted']
+
+
+def find_journals(directory=None):
+    return sorted(glob.glob(os.path.join(directory or default_journal_dir(),
+                                         'run-*.jsonl')))
@@ -0,0 +1,142 @@
+from __future__ import print_function, unicode_literals
+
+import itertools
+import logging
+import sys
+import time
+
+import yaml
+
+from os_nova_servertester.errors import TesterError
+from os_nova_servertester.pool import run_concurrently
+from os_nova_servertester.report import TimingReport, print_results
+from os_nova_servertester.slo import check_run
+
+LOG = logging.getLogger(__name__)
+
+SCENARIO_KEYS = ('image', 'flavor', 'az', 'network', 'count', 'test_script')
+
+
+def load_scenarios(path):
+    '''Load scenarios from a YAML (or JSON) file
+
+    The file may list scenarios explicitly under ``scenarios`` and/or give
+    lists of values under ``matrix`` whose cartesian product is added::
+
+        matrix:
+          image: [ubuntu-22.04]
+          flavor: [small, large]
+          az: [az1, az2]
+        scenarios:
+          - {image: windows-2022, flavor: large, count: 2}
+    '''
+    with open(path) as f:
+        doc = yaml.safe_load(f) or {}
+    if isinstance(doc, list):
+        doc = dict(scenarios=doc)
+    scenarios = list(doc.get('scenarios') or [])
+    matrix = doc.get('matrix') or {}
+    if matrix:
+        keys = sorted(matrix)
+        values = [x if isinstance(x, list) else [x]
+                  for x in (matrix[k] for k in keys)]
+        for combo in itertools.product(*values):
+            scenarios.append(dict(zip(keys, combo)))
+    for scenario in scenarios:
+        unknown = set(scenario) - set(SCENARIO_KEYS)
+        if unknown:
+            raise TesterError('unknown scenario keys: {}'.format(
+                ', '.join(sorted(unknown))))
+        if not scenario.get('image') or not scenario.get('flavor'):
+            raise TesterError(
+                'scenario needs an image and a flavor: {}'.format(scenario))
+    if not scenarios:
+        raise TesterError('no scenarios in {}'.format(path))
+    return scenarios
+
+
+def scenario_name(scenario):
+    return '/'.join(str(scenario[k]) for k in ('image', 'flavor', 'az')
+                    if scenario.get(k))
+
+
+class MatrixRunner(object):
+    '''Runs many test scenarios concurrently in one process
+
+    All scenarios share the client (and so the authenticated session), the
+    API rate limiter, the resolution cache and the rendered userdata given
+    in test_kwargs. Each scenario that passes is checked against the
+    latency objectives on its own.
+    '''
+
+    def __init__(self, test_cls, auth, scenarios, concurrency=4,
+                 objectives=(), history=None, history_days=7,
+                 **test_kwargs):
+        self.test_cls = test_cls
+        self.auth = auth
+        self.scenarios = scenarios
+        self.concurrency = concurrency
+        self.objectives = list(objectives)
+        self.history = history
+        self.history_days = history_days
+        self.test_kwargs = test_kwargs
+        self.tests = {}
+        self.results = []
+        # scenario index -> missed objectives
+        self.breaches = {}
+
+    def run_scenario(self, index):
+        scenario = self.scenarios[index]
+        kwargs = dict(self.test_kwargs)
+        kwargs.update((k, v) for k, v in scenario.items()
+                      if k not in ('image', 'flavor'))
+        test = self.test_cls(self.auth, scenario['image'], scenario['flavor'],
+                             **kwargs)
+        self.tests[index] = test
+        LOG.info('Scenario %s: starting', scenario_name(scenario))
+        start = time.time()
+        try:
+            test.begin()
+        finally:
+            test.wall_time = time.time() - start
+        self.breaches[index] = check_run(test, self.objectives, self.history,
+                                         self.history_days)
+        return test
+
+    def abort(self):
+        for test in self.tests.values():
+            test.abort()
+
+    def run(self):
+        '''Run all scenarios, returns True if all of them passed'''
+        results = run_concurrently(self.run_scenario,
+                                   range(len(self.scenarios)),
+                                   self.concurrency,
+                                   on_interrupt=self.abort)
+        self.results = sorted(results, key=lambda x: x[0])
+        return all(e is None for _, _, e in self.results)
+
+    @property
+    def breached(self):
+        '''Some scenario passed but missed a latency objective'''
+        return any(self.breaches.values())
+
+    def print_table(self, out=sys.stdout):
+        rows = []
+        for index, _, error in self.results:
+            test = self.tests.get(index)
+            stats = {}
+            servers = 0
+            wall = None
+            if test is not None:
+                stats = TimingReport(test.tracked.values()).aggregate()
+                servers = len(test.tracked)
+                wall = getattr(test, 'wall_time', 0)
+            breaches = self.breaches.get(index, [])
+            rows.append((
+                scenario_name(self.scenarios[index]),
+                'FAIL' if error is not None else
+                'SLO' if breaches else 'PASS',
+                servers, stats, wall,
+                ([error] if error is not None else []) + breaches))
+        print_results('scenario', 40, rows, out)
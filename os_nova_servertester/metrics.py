@@ -0,0 +1,227 @@
+from __future__ import print_function, unicode_literals
+
+import bisect
+import logging
+import threading
+
+from six.moves import BaseHTTPServer, socketserver
+
+from os_nova_servertester.report import PHASES
+
+LOG = logging.getLogger(__name__)
+
+PREFIX = 'nova_servertester_'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds, from a fast API call up to a slow Windows boot
+API_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+PHASE_BUCKETS = (1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600, 1200, 1800)
+
+# Server state -> value of the event label of the servers counter
+SERVER_EVENTS = {
+    'created': 'created',
+    'active': 'active',
+    'called-home': 'called_home',
+}
+
+
+def _escape(value):
+    return '{}'.format(value).replace('\\', r'\\').replace(
+        '\n', r'\n').replace('"', r'\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, _escape(v))
+                          for k, v in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, **kwargs):
+        amount = kwargs.get('amount', 1)
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help),
+                 '# TYPE {} counter'.format(self.name)]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append('{}{} {}'.format(
+                    self.name, _labels(self.labelnames, labels),
+                    _number(value)))
+        return lines
+
+
+class Histogram(object):
+    def __init__(self, name, help, buckets, labelnames=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self.labelnames = tuple(labelnames)
+        # labels -> [bucket counts, sum]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self.lock:
+            counts, total = self.values.get(
+                labels, ([0] * len(self.buckets), 0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[labels] = (counts, total + value)
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help),
+                 '# TYPE {} histogram'.format(self.name)]
+        with self.lock:
+            for labels, (counts, total) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    lines.append('{}_bucket{} {}'.format(
+                        self.name,
+                        _labels(self.labelnames, labels,
+                                [('le', _number(bound))]),
+                        cumulative))
+                lines.append('{}_sum{} {}'.format(
+                    self.name, _labels(self.labelnames, labels),
+                    _number(float(total))))
+                lines.append('{}_count{} {}'.format(
+                    self.name, _labels(self.labelnames, labels), cumulative))
+        return lines
+
+
+class TesterMetrics(object):
+    '''Server lifecycle and API latency metrics of a tester process
+
+    Rendered in the Prometheus text exposition format. One instance can be
+    shared by tests running concurrently in the same process.
+    '''
+
+    def __init__(self):
+        self.servers = Counter(
+            PREFIX + 'servers_total',
+            'Servers that reached a lifecycle event', ['event'])
+        self.phases = Histogram(
+            PREFIX + 'phase_seconds',
+            'Duration of server lifecycle phases', PHASE_BUCKETS, ['phase'])
+        self.guest = Histogram(
+            PREFIX + 'guest_seconds',
+            'Timings reported by the shim inside the servers',
+            PHASE_BUCKETS, ['timing'])
+        self.api_calls = Histogram(
+            PREFIX + 'api_call_seconds',
+            'Latency of Nova API calls', API_BUCKETS, ['call'])
+        self.api_errors = Counter(
+            PREFIX + 'api_errors_total',
+            'Nova API calls that raised an error', ['call'])
+        self.connection_stats = []
+
+    def add_connection_stats(self, stats):
+        '''Export the counters of a connpool.ConnectionStats'''
+        if stats not in self.connection_stats:
+            self.connection_stats.append(stats)
+
+    def server_transition(self, tracked, state):
+        '''Account a server entering state for the first time'''
+        if state == 'failed':
+            event = 'timed_out' if tracked.timed_out else 'errored'
+        else:
+            event = SERVER_EVENTS.get(state)
+        if event is not None:
+            self.servers.inc(event)
+        for name, start, end in PHASES:
+            if end == state and start in tracked.timestamps:
+                self.phases.observe(
+                    tracked.timestamps[end] - tracked.timestamps[start], name)
+        if state in ('called-home', 'failed'):
+            for name, value in tracked.guest_timings.items():
+                self.guest.observe(value, name)
+
+    def create_failed(self):
+        self.servers.inc('errored')
+
+    def api_call(self, call, seconds, error=False):
+        self.api_calls.observe(seconds, call)
+        if error:
+            self.api_errors.inc(call)
+
+    def render(self):
+        lines = []
+        for metric in (self.servers, self.phases, self.guest, self.api_calls,
+                       self.api_errors):
+            lines.extend(metric.render())
+        if self.connection_stats:
+            http = Counter(PREFIX + 'http_total',
+                           'HTTP requests and the connections opened for them',
+                           ['kind'])
+            for stats in self.connection_stats:
+                http.inc('requests', amount=stats.requests)
+                http.inc('connections', amount=stats.connections)
+                http.inc('reused', amount=stats.reused)
+            lines.extend(http.render())
+        return '\n'.join(lines) + '\n'
+
+
+class _HTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    server_version = 'os-nova-servertester'
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            return self.send_error(404)
+        body = self.server.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        LOG.debug('%s: %s', self.client_address[0], fmt % args)
+
+
+class MetricsServer(object):
+    '''Serves metrics over HTTP at /metrics for Prometheus to scrape'''
+
+    def __init__(self, metrics, listen='0.0.0.0:9464'):
+        host, _, port = listen.rpartition(':')
+        self.metrics = metrics
+        self.listen_host = host or '0.0.0.0'
+        self.listen_port = int(port or 0)
+        self.httpd = None
+
+    def start(self):
+        self.httpd = _HTTPServer((self.listen_host, self.listen_port),
+                                 _Handler)
+        self.httpd.metrics = self.metrics
+        thread = threading.Thread(target=self.httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+        LOG.info('Serving metrics on http://%s:%s/metrics',
+                 self.httpd.server_address[0], self.httpd.server_address[1])
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
@@ -0,0 +1,148 @@
+from __future__ import print_function, unicode_literals
+
+import logging
+import random
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+
+
+class RateLimiter(object):
+    '''Token bucket that limits the request rate of everything sharing it
+
+    A rate of 0 disables the budget. When the API answers with a rate limit
+    response the limiter blocks all callers for a while and halves the
+    rate, which then recovers gradually as requests succeed.
+    '''
+    MIN_BACKOFF = 1.0
+    MAX_BACKOFF = 60.0
+
+    def __init__(self, rate=0):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.tokens = 1.0
+        self.last = time.time()
+        self.blocked_until = 0
+        self.backoff = self.MIN_BACKOFF
+        self.lock = threading.Lock()
+
+    def _reserve(self):
+        '''Returns how long the caller has to wait for its turn'''
+        with self.lock:
+            now = time.time()
+            wait = max(0, self.blocked_until - now)
+            if self.rate > 0:
+                self.tokens = min(
+                    max(self.rate, 1.0),
+                    self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                self.tokens -= 1
+                if self.tokens < 0:
+                    wait = max(wait, -self.tokens / self.rate)
+            return wait
+
+    def acquire(self):
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def success(self):
+        with self.lock:
+            self.backoff = self.MIN_BACKOFF
+            if self.max_rate > 0 and self.rate < self.max_rate:
+                self.rate = min(self.max_rate,
+                                self.rate + self.max_rate * 0.05)
+
+    def throttle(self, retry_after=None):
+        '''Block everybody after a rate limit response
+
+        Returns the applied delay.
+        '''
+        with self.lock:
+            delay = max(float(retry_after or 0), self.backoff)
+            self.backoff = min(self.MAX_BACKOFF, self.backoff * 2)
+            self.blocked_until = max(self.blocked_until, time.time() + delay)
+            if self.rate > 0:
+                self.rate = max(self.rate / 2, 0.1)
+            return delay
+
+
+class ServerView(object):
+    '''Local copy of the servers of a run, kept current with changes-since
+
+    list_servers is called with changes_since set to the newest update
+    time seen so far and the changed servers are merged in. Only Nova's own
+    times are used so that the local clock does not matter, at the cost of
+    fetching the servers last updated in that second again. Every
+    resync_interval seconds, and until Nova reports update
+    times, everything is listed instead to catch anything missed and to
+    forget servers that are gone. Nova does not touch the update time when
+    only metadata changes, so reading fresh metadata needs a full listing.
+    '''
+
+    def __init__(self, list_servers, resync_interval=60):
+        self.list_servers = list_servers
+        self.resync_interval = resync_interval
+        self.servers = {}
+        self.since = None
+        self.last_resync = None
+
+    def refresh(self, full=False):
+        '''Fetch changes, or everything if full, returns what was fetched'''
+        now = time.time()
+        if (full or self.since is None or
+                now - self.last_resync >= self.resync_interval):
+            fetched = self.list_servers()
+            self.servers = dict((x.id, x) for x in fetched)
+            self.last_resync = now
+        else:
+            fetched = self.list_servers(changes_since=self.since)
+            for server in fetched:
+                self.servers[server.id] = server
+        # Same ISO 8601 format as Nova uses, so strings compare as times
+        updated = [x for x in (getattr(y, 'updated', None) for y in fetched)
+                   if x]
+        if updated:
+            self.since = max(updated + ([self.since] if self.since else []))
+        return fetched
+
+    def get(self, server_ids, full=False):
+        '''Current copies of the given servers, omitting unknown ones'''
+        self.refresh(full)
+        return [self.servers[x] for x in server_ids if x in self.servers]
+
+
+class PollScheduler(object):
+    '''Computes delays between polling rounds of a wait phase
+
+    Until the expected duration of the phase has passed there is little
+    point in polling often, so the delay is half of the remaining expected
+    time. After that the delay starts from initial and backs off
+    exponentially up to maximum for every round that made no progress.
+    '''
+
+    def __init__(self, initial=1, maximum=10, factor=1.5, jitter=0.1,
+                 expected=None):
+        self.initial = initial
+        self.maximum = max(initial, maximum)
+        self.factor = factor
+        self.jitter = jitter
+        self.expected = expected
+        self.start = time.time()
+        self.idle_rounds = 0
+
+    def next_delay(self, progress=False):
+        if progress:
+            self.idle_rounds = 0
+        else:
+            self.idle_rounds += 1
+        elapsed = time.time() - self.start
+        if self.expected and elapsed < self.expected:
+            delay = max(self.initial, (self.expected - elapsed) / 2.0)
+        else:
+            delay = self.initial * self.factor ** max(self.idle_rounds - 1, 0)
+        delay = min(self.maximum, delay)
+        if self.jitter:
+            delay *= 1 + random.uniform(-self.jitter, self.jitter)
+        return delay
@@ -0,0 +1,59 @@
+from __future__ import print_function, unicode_literals
+
+import logging
+import sys
+import threading
+from multiprocessing.pool import ThreadPool
+
+import six
+
+LOG = logging.getLogger(__name__)
+
+
+class Cancelled(RuntimeError):
+    pass
+
+
+def run_concurrently(func, items, concurrency=1, on_interrupt=None):
+    '''Call func for every item using at most concurrency threads
+
+    Returns a list of (item, result, exception) tuples in completion order.
+    Exceptions raised by func are captured, not raised. On interrupt the
+    calls already in progress are allowed to finish (so that their side
+    effects can be rolled back) and the remaining items are cancelled.
+    on_interrupt is called first to let long running calls wind down.
+    '''
+    stop = threading.Event()
+
+    def call(item, catch=Exception):
+        if stop.is_set():
+            return item, None, Cancelled('cancelled')
+        try:
+            return item, func(item), None
+        except catch as e:
+            LOG.debug('%s(%s) failed: %s', func.__name__, item, e)
+            return item, None, e
+
+    def pooled_call(item):
+        # An interrupt raised inside a worker thread would kill the worker
+        # and hang the pool, so it is captured like any other error
+        return call(item, (Exception, KeyboardInterrupt))
+
+    items = list(items)
+    if concurrency <= 1 or len(items) <= 1:
+        return [call(x) for x in items]
+
+    results = []
+    pool = ThreadPool(min(concurrency, len(items)))
+    try:
+        for res in pool.imap_unordered(pooled_call, items):
+            results.append(res)
+    except (Exception, KeyboardInterrupt):
+        stop.set()
+        if on_interrupt is not None:
+            on_interrupt()
+        six.reraise(*sys.exc_info())
+    finally:
+        pool.close()
+        pool.join()
+    return results
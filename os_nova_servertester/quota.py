@@ -0,0 +1,25 @@
+from __future__ import print_function, unicode_literals
+
+# Absolute limit, its usage and the flavor attribute one server uses of it
+LIMITS = (
+    ('maxTotalInstances', 'totalInstancesUsed', None),
+    ('maxTotalCores', 'totalCoresUsed', 'vcpus'),
+    ('maxTotalRAMSize', 'totalRAMUsed', 'ram'),
+)
+
+
+def headroom(absolute, flavor):
+    '''How many more servers of flavor fit in the absolute limits
+
+    absolute is what ``limits.get().absolute`` returns. None if nothing is
+    limited, a negative limit means unlimited.
+    '''
+    values = dict((x.name, x.value) for x in absolute)
+    fits = []
+    for limit_name, used_name, attr in LIMITS:
+        limit = values.get(limit_name)
+        size = getattr(flavor, attr, 0) if attr else 1
+        if limit is None or limit < 0 or not size:
+            continue
+        fits.append(max(limit - values.get(used_name, 0), 0) // size)
+    return min(fits) if fits else None
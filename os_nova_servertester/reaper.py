@@ -0,0 +1,112 @@
+from __future__ import print_function, unicode_literals
+
+import calendar
+import logging
+import os
+import time
+
+from os_nova_servertester.errors import TesterError
+from os_nova_servertester.journal import JournalState, find_journals
+from os_nova_servertester.pool import run_concurrently
+from os_nova_servertester.server.userdata import TEST_STATUS_KEY
+from os_nova_servertester.warmpool import POOL_KEY
+
+LOG = logging.getLogger(__name__)
+
+NAME_PREFIX = 'test-server-'
+
+
+def server_age(server):
+    '''Seconds since nova created server, None if unknown'''
+    try:
+        created = calendar.timegm(
+            time.strptime(server.created, '%Y-%m-%dT%H:%M:%SZ'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+    return time.time() - created
+
+
+def in_pool(server):
+    '''Warm pool servers are kept on purpose and expire on their own'''
+    return POOL_KEY in (server.metadata or {})
+
+
+class Reaper(object):
+    '''Deletes servers leaked by tester runs that did not clean up
+
+    Leftovers are found from run journals, whose name prefix covers even
+    servers created right before the tester died, or by the naming and
+    metadata convention the tester uses for all its servers.
+    '''
+
+    def __init__(self, client, concurrency=8, older_than=3600,
+                 dry_run=False):
+        self.client = client
+        self.concurrency = concurrency
+        self.older_than = older_than
+        self.dry_run = dry_run
+
+    def list_servers(self, prefix):
+        return self.client.servers.list(
+            detailed=True, search_opts={'name': '^' + prefix}, limit=-1)
+
+    def from_journal(self, state):
+        '''Servers that still exist of the run the journal belongs to'''
+        return [x for x in self.list_servers(state.prefix)
+                if not in_pool(x)]
+
+    def by_convention(self, prefix=NAME_PREFIX):
+        '''Tester servers older than older_than seconds'''
+        ret = []
+        for server in self.list_servers(prefix):
+            age = server_age(server)
+            if TEST_STATUS_KEY not in (server.metadata or {}):
+                continue
+            if in_pool(server):
+                continue
+            if age is None or age < self.older_than:
+                continue
+            ret.append(server)
+        return ret
+
+    def delete(self, servers):
+        '''Delete servers concurrently, returns the number of failures'''
+        for server in servers:
+            LOG.info('%s server %s (%s)',
+                     'Would delete' if self.dry_run else 'Deleting',
+                     server.id, server.name)
+        if self.dry_run or not servers:
+            return 0
+        errors = 0
+        for server, _, e in run_concurrently(self.client.servers.delete,
+                                             servers, self.concurrency):
+            if e is not None:
+                LOG.error('Server %s: error while deleting: %s', server.id, e)
+                errors += 1
+        return errors
+
+    def reap_journals(self, paths=None, directory=None, force=False):
+        '''Delete the leftovers of journaled runs that are not running
+
+        Journals of runs that have nothing left are removed. Returns the
+        number of servers that could not be deleted.
+        '''
+        errors = 0
+        for path in paths or find_journals(directory):
+            try:
+                state = JournalState(path)
+            except (IOError, OSError, TesterError) as e:
+                LOG.warning('Cannot read journal %s: %s', path, e)
+                continue
+            if state.is_running() and not force:
+                LOG.info('Run %s is still running, skipping', state.run_id)
+                continue
+            servers = self.from_journal(state)
+            if not servers:
+                LOG.info('Run %s: nothing left', state.run_id)
+                if not self.dry_run:
+                    os.unlink(path)
+                continue
+            LOG.info('Run %s: %d servers left', state.run_id, len(servers))
+            errors += self.delete(servers)
+        return errors
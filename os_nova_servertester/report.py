@@ -0,0 +1,139 @@
+from __future__ import print_function, unicode_literals
+
+import csv
+import json
+import logging
+import math
+import sys
+import time
+
+import six
+
+from os_nova_servertester.server.userdata import GUEST_TIMINGS
+
+LOG = logging.getLogger(__name__)
+
+monotonic = getattr(time, 'monotonic', time.time)
+
+# name, start state, end state
+PHASES = (
+    ('create', 'requested', 'created'),
+    ('build', 'created', 'active'),
+    ('callhome', 'active', 'called-home'),
+    ('delete', 'deleting', 'deleted'),
+    ('total', 'requested', 'called-home'),
+)
+PHASE_NAMES = tuple(x[0] for x in PHASES)
+PERCENTILES = (50, 90, 95, 99)
+# In-guest timings reported by the shim, prefixed to tell them apart from
+# the phases measured by the tester
+GUEST_PREFIX = 'guest_'
+
+
+def percentile(values, pct):
+    '''Nearest-rank percentile of values'''
+    if not values:
+        return None
+    values = sorted(values)
+    rank = int(math.ceil(pct / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+def phase_durations(timestamps):
+    '''Returns phase name -> seconds for phases with both ends recorded'''
+    durations = {}
+    for name, start, end in PHASES:
+        if start in timestamps and end in timestamps:
+            durations[name] = round(timestamps[end] - timestamps[start], 3)
+    return durations
+
+
+class TimingReport(object):
+    '''Per-server phase latencies and their aggregates'''
+
+    def __init__(self, trackers):
+        self.rows = []
+        for tracked in trackers:
+            row = dict(
+                server_id=tracked.id,
+                state=tracked.state,
+                error=tracked.error or '')
+            row.update(phase_durations(tracked.timestamps))
+            row.update((GUEST_PREFIX + k, v)
+                       for k, v in tracked.guest_timings.items())
+            self.rows.append(row)
+        guest = set(k for row in self.rows for k in row
+                    if k.startswith(GUEST_PREFIX))
+        self.phase_names = PHASE_NAMES + tuple(
+            GUEST_PREFIX + x for x in GUEST_TIMINGS
+            if GUEST_PREFIX + x in guest)
+
+    def aggregate(self):
+        '''Returns phase name -> dict of count, p50, p90, p95, p99 and max'''
+        ret = {}
+        for name in self.phase_names:
+            values = [x[name] for x in self.rows if name in x]
+            stats = dict(count=len(values), max=max(values) if values else None)
+            for pct in PERCENTILES:
+                stats['p{}'.format(pct)] = percentile(values, pct)
+            ret[name] = stats
+        return ret
+
+    def log_summary(self):
+        aggregate = self.aggregate()
+        for name in self.phase_names:
+            stats = aggregate[name]
+            if stats['count']:
+                LOG.info('Phase %-14s n=%-5d p50=%.2fs p90=%.2fs p99=%.2fs '
+                         'max=%.2fs', name, stats['count'], stats['p50'],
+                         stats['p90'], stats['p99'], stats['max'])
+
+    def write_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(dict(servers=self.rows, phases=self.aggregate()), f,
+                      indent=2, sort_keys=True)
+
+    def write_csv(self, path):
+        fields = ('kind', 'server_id', 'state', 'error') + self.phase_names
+        if six.PY2:
+            f = open(path, 'wb')
+        else:
+            f = open(path, 'w', newline='')
+        with f:
+            writer = csv.DictWriter(f, fields, extrasaction='ignore')
+            writer.writeheader()
+            for row in self.rows:
+                writer.writerow(dict(row, kind='server'))
+            aggregate = self.aggregate()
+            for stat in ['p{}'.format(x) for x in PERCENTILES] + ['max']:
+                row = dict((name, aggregate[name][stat])
+                           for name in self.phase_names)
+                row['kind'] = stat
+                writer.writerow(row)
+
+
+def print_results(title, width, results, out=sys.stdout):
+    '''Print a table of runs with their key latencies
+
+    results are (name, result, servers, aggregate, wall, notes) tuples,
+    where aggregate is what TimingReport.aggregate returns, wall is in
+    seconds or None and notes are printed indented below the run.
+    '''
+    fmt = '{:<%d} {:<8} {:>7} {:>9} {:>9} {:>9} {:>8}' % width
+    print(fmt.format(title, 'result', 'servers', 'build p50', 'build p90',
+                     'callhome', 'wall'), file=out)
+    for name, result, servers, stats, wall, notes in results:
+        def fmt_stat(phase, stat):
+            value = stats.get(phase, {}).get(stat)
+            return '-' if value is None else '{:.1f}s'.format(value)
+
+        print(fmt.format(
+            name[:width],
+            result,
+            servers,
+            fmt_stat('build', 'p50'),
+            fmt_stat('build', 'p90'),
+            fmt_stat('callhome', 'p50'),
+            '' if wall is None else '{:.1f}s'.format(wall)), file=out)
+        for note in notes:
+            print('    {}'.format(note), file=out)
@@ -0,0 +1,138 @@
+from __future__ import print_function, unicode_literals
+
+import json
+import logging
+import re
+import socket
+import threading
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import urlparse
+
+from os_nova_servertester.errors import TesterError
+
+LOG = logging.getLogger(__name__)
+
+TOKEN_HEADER = 'X-Callhome-Token'
+PATH_RE = re.compile(r'^/callhome/([0-9a-fA-F-]+)/?$')
+
+
+class _HTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    server_version = 'os-nova-servertester'
+
+    def do_POST(self):
+        receiver = self.server.receiver
+        match = PATH_RE.match(self.path)
+        if not match:
+            return self.send_error(404)
+        if self.headers.get(TOKEN_HEADER) != receiver.token:
+            return self.send_error(403)
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            report = json.loads(self.rfile.read(length).decode('utf-8'))
+            if not isinstance(report, dict) or 'status' not in report:
+                raise ValueError('status missing')
+        except ValueError as e:
+            return self.send_error(400, str(e))
+        receiver.add_report(match.group(1), report)
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, fmt, *args):
+        LOG.debug('%s: %s', self.client_address[0], fmt % args)
+
+
+class CallhomeReceiver(object):
+    '''HTTP listener that collects test reports pushed by the shim
+
+    The shim POSTs a JSON document with at least a ``status`` key to
+    ``<url>/callhome/<server id>`` with the shared token in a header.
+    '''
+
+    def __init__(self, listen='0.0.0.0:0', url=None, token=None):
+        host, _, port = listen.rpartition(':')
+        self.listen_host = host or '0.0.0.0'
+        self.listen_port = int(port or 0)
+        self.advertise_url = url
+        self.token = token
+        self.reports = {}
+        # Reports received so far, discarded ones included
+        self.received = 0
+        self.cond = threading.Condition()
+        self.httpd = None
+
+    def start(self, peer_url=None):
+        '''Start listening. peer_url is used to guess the address to
+        advertise when no explicit url was given'''
+        self.httpd = _HTTPServer((self.listen_host, self.listen_port),
+                                 _Handler)
+        self.httpd.receiver = self
+        thread = threading.Thread(target=self.httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+        if self.advertise_url is None:
+            self.advertise_url = 'http://{}:{}'.format(
+                self._local_address(peer_url), self.httpd.server_address[1])
+        LOG.info('Callhome receiver listening on %s:%s, advertised as %s',
+                 self.httpd.server_address[0], self.httpd.server_address[1],
+                 self.advertise_url)
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+    @property
+    def url(self):
+        return self.advertise_url
+
+    def _local_address(self, peer_url):
+        if self.listen_host not in ('', '0.0.0.0', '::'):
+            return self.listen_host
+        if not peer_url:
+            raise TesterError(
+                'cannot guess callhome address, please specify callhome url')
+        # The address used to reach the API is the most likely one that
+        # servers in the cloud can reach us with too
+        parsed = urlparse(peer_url)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.connect((parsed.hostname, parsed.port or 80))
+            return sock.getsockname()[0]
+        finally:
+            sock.close()
+
+    def add_report(self, server_id, report):
+        with self.cond:
+            LOG.debug('Callhome report from %s: %s', server_id, report)
+            self.reports[server_id] = report
+            self.received += 1
+            self.cond.notify_all()
+
+    def get_reports(self):
+        with self.cond:
+            return dict(self.reports)
+
+    def discard(self, server_id):
+        '''Drop the report of a server that is no longer tracked'''
+        with self.cond:
+            self.reports.pop(server_id, None)
+
+    def wait(self, timeout, stop=None):
+        '''Block until a new report arrives, stop is set or timeout expires'''
+        with self.cond:
+            count = self.received
+            if stop is None or not stop.is_set():
+                self.cond.wait(timeout)
+            return self.received != count
+
+    def wake(self):
+        '''Wake up all waiters so that they notice their stop event'''
+        with self.cond:
+            self.cond.notify_all()
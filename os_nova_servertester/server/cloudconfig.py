@@ -1,7 +1,10 @@
 from __future__ import print_function, unicode_literals
 
 import base64
-import yaml
+import gzip
+import io
+
+import six
 
 class CloudConfigGenerator(object):
     def __init__(self):
@@ -17,7 +20,8 @@ class CloudConfigGenerator(object):
         self.write_files.append(
             dict(
                 encoding='b64',
-                content=base64.b64encode(content),
+                content=base64.b64encode(
+                    six.ensure_binary(content)).decode('ascii'),
                 permissions=mode,
                 path=path,
             )
@@ -29,9 +33,19 @@ class CloudConfigGenerator(object):
     def add_package(self, *pkgs):
         self.packages.extend(pkgs)
 
-    def generate(self):
-        return "#cloud-config\n" + yaml.safe_dump(dict(
+    def generate(self, compress=False):
+        '''Returns the cloud-config, gzip compressed bytes if compress is
+        set. cloud-init detects and decompresses gzip userdata itself'''
+        import yaml
+        userdata = "#cloud-config\n" + yaml.safe_dump(dict(
             packages=self.packages,
             write_files=self.write_files,
             runcmd=self.runcmd,
         ))
+        if not compress:
+            return userdata
+        buf = io.BytesIO()
+        # Fixed mtime keeps the output identical for identical input
+        with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as f:
+            f.write(userdata.encode('utf-8'))
+        return buf.getvalue()
@@ -3,6 +3,8 @@ from __future__ import print_function, unicode_literals
 import base64
 from string import Template
 
+import six
+
 from os_nova_servertester.errors import TesterError
 
 
@@ -15,41 +17,94 @@ METADATA_KEY=${METADATA_KEY}
 METADATA_VALUE_OK=${METADATA_VALUE_OK}
 METADATA_VALUE_ERR=${METADATA_VALUE_ERR}
 METADATA_EXITCODE_KEY=${METADATA_EXITCODE_KEY}
+METADATA_TIMINGS_KEY=${METADATA_TIMINGS_KEY}
+CALLHOME_URL=${CALLHOME_URL}
+CALLHOME_TOKEN=${CALLHOME_TOKEN}
+UPTIME=$(cut -d' ' -f1 /proc/uptime)
+PYTHON=$(which python3 || which python)
+
+INSTANCE_ID=$(curl -s http://169.254.169.254/openstack/latest/meta_data.json | $PYTHON -c 'import sys,json; sys.stdout.write(json.load(sys.stdin)["uuid"])')
+
+# Durations of the cloud-init stages as name=secs pairs. The final stage
+# is the one running us, so it is measured up to now.
+function cloud_init_timings() {
+	$PYTHON - <<'END' 2>/dev/null || true
+import json, time
+v1 = json.load(open('/run/cloud-init/status.json'))['v1']
+out = []
+for stage, name in (('init-local', 'init_local'), ('init', 'init'),
+                    ('modules-config', 'config'), ('modules-final', 'final')):
+    s = v1.get(stage) or {}
+    if s.get('start'):
+        out.append('%s=%.1f' % (name, (s.get('finished') or time.time()) - s['start']))
+print(','.join(out))
+END
+}
 
-INSTANCE_ID=$(curl -s http://169.254.169.254/openstack/latest/meta_data.json | $(which python || which python3) -c 'import sys,json; sys.stdout.write(json.load(sys.stdin)["uuid"])')
+function elapsed() {
+	awk "BEGIN { printf \\"%.1f\\", $(date +%s.%N) - $1 }"
+}
+
+TIMINGS="uptime=$UPTIME"
+STAGES=$(cloud_init_timings)
+if [ -n "$STAGES" ]; then
+	TIMINGS="$TIMINGS,$STAGES"
+fi
 
+# Status, exit code and timings go in a single request so that the
+# tester never sees a status without the rest
 function set_metadata() {
-	key=$1
-	val=$2
+	status=$1
+	code=$2
 	url="$NOVA_ENDPOINT/servers/$INSTANCE_ID/metadata"
-	echo "Reporting: $key -> $val to $url"
+	echo "Reporting: $status ($code) $TIMINGS to $url"
 	/usr/bin/curl -s -f -X POST \
 		$url \
 		-H "User-Agent: os-nova-servertester" \
 		-H "Content-Type: application/json" \
 		-H "Accept: application/json" \
 		-H "X-Auth-Token: $OS_AUTH_TOKEN" \
-		-d "{\\"metadata\\": {\\"$key\\": \\"$val\\"}}"
+		-d "{\\"metadata\\": {\\"$METADATA_KEY\\": \\"$status\\", \\"$METADATA_EXITCODE_KEY\\": \\"$code\\", \\"$METADATA_TIMINGS_KEY\\": \\"$TIMINGS\\"}}"
+}
+
+function callhome() {
+	status=$1
+	code=$2
+	if [ -z "$CALLHOME_URL" ]; then
+		return 1
+	fi
+	url="$CALLHOME_URL/callhome/$INSTANCE_ID"
+	echo "Reporting: $status ($code) $TIMINGS to $url"
+	/usr/bin/curl -s -f -X POST \
+		$url \
+		--connect-timeout 10 \
+		-H "User-Agent: os-nova-servertester" \
+		-H "Content-Type: application/json" \
+		-H "X-Callhome-Token: $CALLHOME_TOKEN" \
+		-d "{\\"status\\": \\"$status\\", \\"exitcode\\": $code, \\"timings\\": \\"$TIMINGS\\"}"
 }
 
 function report() {
 	code=$1
 	if [ $code -eq 0 ]; then
-		set_metadata $METADATA_KEY $METADATA_VALUE_OK
+		status=$METADATA_VALUE_OK
 	else
-		set_metadata $METADATA_EXITCODE_KEY $code
-		set_metadata $METADATA_KEY $METADATA_VALUE_ERR
+		status=$METADATA_VALUE_ERR
 	fi
+	# Fall back to nova metadata if the tester is not reachable
+	if callhome $status $code; then
+		return 0
+	fi
+	set_metadata $status $code
 }
 
+code=0
 if [ -f $SCRIPT ]; then
+	script_start=$(date +%s.%N)
 	$SCRIPT || code=$?
-	if [ ! $code -eq 0 ]; then
-		report $code
-		exit 0
-	fi
+	TIMINGS="$TIMINGS,script=$(elapsed $script_start)"
 fi
-report 0
+report $code
 ''')
 
 TPL_PS = Template('''
@@ -69,30 +124,81 @@ $env:metadata_key = "${METADATA_KEY}"
 $env:metadata_value_ok = "${METADATA_VALUE_OK}"
 $env:metadata_value_err = "${METADATA_VALUE_ERR}"
 $env:metadata_exitcode_key = "${METADATA_EXITCODE_KEY}"
+$env:metadata_timings_key = "${METADATA_TIMINGS_KEY}"
+$env:callhome_url = "${CALLHOME_URL}"
+$env:callhome_token = "${CALLHOME_TOKEN}"
+
+function Seconds($span) {
+    [math]::Round($span.TotalSeconds, 1).ToString([Globalization.CultureInfo]::InvariantCulture)
+}
+
+# Timings as name=secs pairs: time since boot and since cloudbase-init
+# started when this shim started, later the test script runtime
+$global:timings = @()
+try {
+    $boot = (Get-CimInstance Win32_OperatingSystem).LastBootUpTime
+    $global:timings += "uptime=$(Seconds ((Get-Date) - $boot))"
+    $service = Get-CimInstance Win32_Service -Filter "Name='cloudbase-init'"
+    $process = Get-Process -Id $service.ProcessId
+    $global:timings += "cloudbase_init=$(Seconds ((Get-Date) - $process.StartTime))"
+} catch {
+}
 
 $env:instance_id = (Invoke-RestMethod -Uri http://169.254.169.254/openstack/latest/meta_data.json -TimeoutSec $global:http_timeout).uuid
 
-function SetMetadata($key, $val) {
+# Status, exit code and timings go in a single request so that the
+# tester never sees a status without the rest
+function SetMetadata($status, $code) {
     $url = "$($env:nova_endpoint)/servers/$($env:instance_id)/metadata"
-    Write-Output "Reporting: $key -> $val to $url" | timestamp
+    Write-Output "Reporting: $status ($code) to $url" | timestamp
     $headers = @{
         'X-Auth-Token' = $env:os_auth_token
     }
     $body = @{
         metadata = @{
-            $key = $val.toString()
+            $env:metadata_key = $status
+            $env:metadata_exitcode_key = $code.toString()
+            $env:metadata_timings_key = $global:timings -join ","
         }
     } | ConvertTo-Json
     Invoke-RestMethod -Method POST -Verbose -Uri $url -ContentType 'application/json' -Body $body -Headers $headers -TimeoutSec $global:http_timeout
 }
 
+function Callhome($status, $code) {
+    if($env:callhome_url -eq "") {
+        return $false
+    }
+    $url = "$($env:callhome_url)/callhome/$($env:instance_id)"
+    # Write-Host so that log lines do not end up in the return value
+    Write-Host ("Reporting: $status ($code) to $url" | timestamp)
+    $headers = @{
+        'X-Callhome-Token' = $env:callhome_token
+    }
+    $body = @{
+        status = $status
+        exitcode = $code
+        timings = $global:timings -join ","
+    } | ConvertTo-Json
+    try {
+        Invoke-RestMethod -Method POST -Uri $url -ContentType 'application/json' -Body $body -Headers $headers -TimeoutSec $global:http_timeout | Out-Null
+        return $true
+    } catch {
+        Write-Host ("Callhome failed: $($_.Exception.Message)" | timestamp)
+        return $false
+    }
+}
+
 function Report($code) {
     if($code -eq 0) {
-        SetMetadata $env:metadata_key $env:metadata_value_ok
+        $status = $env:metadata_value_ok
     } else {
-        SetMetadata $env:metadata_exitcode_key $code
-        SetMetadata $env:metadata_key $env:metadata_value_err
+        $status = $env:metadata_value_err
+    }
+    # Fall back to nova metadata if the tester is not reachable
+    if(Callhome $status $code) {
+        return
     }
+    SetMetadata $status $code
 }
 
 Start-Transcript $global:output_log
@@ -100,8 +206,10 @@ try {
     if($testscript -ne "") {
         $script = [System.Text.Encoding]::UTF8.GetString([Convert]::FromBase64String($testscript))
         Write-Output("Executing user test script") | timestamp
+        $script_start = Get-Date
         Write-Output $script | powershell -noprofile -
         $code = $LASTEXITCODE
+        $global:timings += "script=$(Seconds ((Get-Date) - $script_start))"
         if($code -ne 0) {
             Report $code
             [System.Environment]::Exit(0)
@@ -131,7 +239,10 @@ def get_script(os_auth_token,
                metadata_value_err,
                metadata_exitcode_key,
                test_script_content='',
-               script_type='bash'):
+               script_type='bash',
+               callhome_url='',
+               callhome_token='',
+               metadata_timings_key='SimpleTestTimings'):
 
     if script_type == 'bash':
         tpl = TPL_BASH
@@ -148,4 +259,8 @@ def get_script(os_auth_token,
         METADATA_VALUE_OK=metadata_value_ok,
         METADATA_VALUE_ERR=metadata_value_err,
         METADATA_EXITCODE_KEY=metadata_exitcode_key,
-        test_script_content=base64.b64encode(test_script_content))
+        METADATA_TIMINGS_KEY=metadata_timings_key,
+        CALLHOME_URL=callhome_url or '',
+        CALLHOME_TOKEN=callhome_token or '',
+        test_script_content=base64.b64encode(
+            six.ensure_binary(test_script_content)).decode('ascii'))
@@ -0,0 +1,132 @@
+from __future__ import print_function, unicode_literals
+
+import base64
+import gzip
+import io
+
+import six
+
+from os_nova_servertester.errors import TesterError
+from os_nova_servertester.server import shim
+from os_nova_servertester.server.cloudconfig import CloudConfigGenerator
+
+TEST_STATUS_KEY = 'SimpleTestStatus'
+TEST_STATUS_PENDING = 'pending'
+TEST_STATUS_COMPLETE = 'complete'
+TEST_STATUS_ERROR = 'error'
+
+TEST_STATUS_EXITCODE_KEY = 'SimpleTestExitStatus'
+TEST_TIMINGS_KEY = 'SimpleTestTimings'
+
+# In-guest timings the shims report, in seconds: uptime when the shim
+# started, cloud-init stage durations or time since cloudbase-init
+# started, and the runtime of the test script
+GUEST_TIMINGS = ('uptime', 'init_local', 'init', 'config', 'final',
+                 'cloudbase_init', 'script')
+
+# Nova limit for base64 encoded user_data
+USERDATA_LIMIT = 65535
+
+TEST_SHIM = '/run_test.sh'
+USER_TEST_SCRIPT = '/user_test.sh'
+
+
+def render(os_auth_token,
+           nova_endpoint,
+           test_script_content='',
+           shim_type='bash',
+           cloud_init_type='cloud-init',
+           compress=False,
+           callhome_url='',
+           callhome_token=''):
+    '''Returns the userdata that runs the test shim on the server'''
+    # Only the powershell shim embeds the test script, the bash shim
+    # runs the copy written by cloud-init
+    embed_script = shim_type == 'powershell'
+    shimscript = shim.get_script(
+        os_auth_token,
+        nova_endpoint,
+        USER_TEST_SCRIPT,
+        TEST_STATUS_KEY,
+        TEST_STATUS_COMPLETE,
+        TEST_STATUS_ERROR,
+        TEST_STATUS_EXITCODE_KEY,
+        test_script_content=test_script_content if embed_script else '',
+        script_type=shim_type,
+        callhome_url=callhome_url,
+        callhome_token=callhome_token,
+        metadata_timings_key=TEST_TIMINGS_KEY)
+    if cloud_init_type == 'cloud-init':
+        cconfig = CloudConfigGenerator()
+        # Ensure curl is installed
+        cconfig.add_write_file(TEST_SHIM, shimscript, mode='0750')
+        if test_script_content and not embed_script:
+            cconfig.add_write_file(
+                USER_TEST_SCRIPT, test_script_content, mode='0750')
+        if shim_type == 'bash':
+            cconfig.add_package('curl')
+            cconfig.add_runcmd('/bin/bash', TEST_SHIM)
+        elif shim_type == 'powershell':
+            cconfig.add_runcmd('/usr/bin/env', 'powershell', '-File',
+                               TEST_SHIM)
+        else:
+            raise TesterError('unsupported shim type: {}'.format(shim_type))
+        return cconfig.generate(compress=compress)
+    elif cloud_init_type == 'cloudbase-init':
+        userdata = []
+        userdata.append('#ps1_sysnative')
+        userdata.append(shimscript)
+        return "\n".join(userdata)
+    else:
+        raise TesterError('Unsupported cloud-init type: {}'.format(
+            cloud_init_type))
+
+
+def parse_timings(value):
+    '''Parse the name=secs,... timings reported by the shim'''
+    timings = {}
+    for item in (value or '').split(','):
+        name, _, secs = item.partition('=')
+        if name.strip() in GUEST_TIMINGS:
+            try:
+                timings[name.strip()] = float(secs)
+            except ValueError:
+                pass
+    return timings
+
+
+def check_size(userdata):
+    '''Returns the raw and base64 encoded size, raises if nova would
+    reject the userdata'''
+    size = len(base64.b64encode(six.ensure_binary(userdata)))
+    if size > USERDATA_LIMIT:
+        raise TesterError(
+            'userdata is {} bytes encoded, nova accepts at most {}'.format(
+                size, USERDATA_LIMIT))
+    return len(userdata), size
+
+
+def validate(userdata):
+    '''Check that rendered userdata parses and carries the test shim'''
+    if isinstance(userdata, bytes):
+        with gzip.GzipFile(fileobj=io.BytesIO(userdata)) as f:
+            userdata = f.read().decode('utf-8')
+    if userdata.startswith('#ps1_sysnative'):
+        return
+    if not userdata.startswith('#cloud-config\n'):
+        raise TesterError('userdata is not a cloud-config')
+    import yaml
+    try:
+        doc = yaml.safe_load(userdata)
+    except yaml.YAMLError as e:
+        raise TesterError('userdata is not valid YAML: {}'.format(e))
+    paths = []
+    for item in doc.get('write_files') or []:
+        try:
+            base64.b64decode(item['content'])
+        except (KeyError, TypeError, ValueError) as e:
+            raise TesterError('bad write_files entry {}: {}'.format(
+                item.get('path'), e))
+        paths.append(item.get('path'))
+    if TEST_SHIM not in paths:
+        raise TesterError('userdata does not write the test shim')
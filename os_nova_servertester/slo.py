@@ -0,0 +1,171 @@
+'''Latency objectives checked against each run and a history of runs
+
+An objective limits a statistic of a phase, either to a number of
+seconds or to a percentage above its median over the recent history of
+runs with the same cloud, image and flavor::
+
+    build.p95<=90
+    total.p50<=+25%
+'''
+from __future__ import print_function, unicode_literals
+
+import json
+import logging
+import os
+import re
+import time
+
+from os_nova_servertester.cache import default_cache_dir
+from os_nova_servertester.errors import TesterError
+from os_nova_servertester.report import (GUEST_PREFIX, PERCENTILES,
+                                         PHASE_NAMES, TimingReport,
+                                         percentile)
+from os_nova_servertester.server.userdata import GUEST_TIMINGS
+
+LOG = logging.getLogger(__name__)
+
+# Exit code of a run that passed but missed an objective
+SLO_BREACH_EXIT = 3
+
+SPEC_RE = re.compile(
+    r'^(?P<phase>\w+)\.(?P<stat>p\d+|max)\s*<=\s*'
+    r'(?:(?P<pct>\+\d+(?:\.\d+)?)%|(?P<secs>\d+(?:\.\d+)?)s?)$')
+
+OBJECTIVE_PHASES = PHASE_NAMES + tuple(GUEST_PREFIX + x for x in GUEST_TIMINGS)
+# Statistics the history keeps, which relative objectives compare to
+HISTORY_STATS = tuple('p{}'.format(x) for x in PERCENTILES) + ('max',)
+
+
+def default_history_path():
+    return os.path.join(default_cache_dir(), 'history.jsonl')
+
+
+def run_key(test):
+    '''What runs are compared by: the cloud, image and flavor'''
+    return dict(
+        cloud=test.client.client.get_endpoint(),
+        image=getattr(test.image, 'name', None) or test.image.id,
+        flavor=getattr(test.flavor, 'name', None) or test.flavor.id)
+
+
+class Objective(object):
+    def __init__(self, spec):
+        match = SPEC_RE.match(spec.strip())
+        if match is None:
+            raise TesterError(
+                'invalid objective {!r}, expected PHASE.STAT<=SECS '
+                'or PHASE.STAT<=+PCT%'.format(spec))
+        self.spec = spec.strip()
+        self.phase = match.group('phase')
+        self.stat = match.group('stat')
+        self.relative = match.group('pct') is not None
+        self.limit = float(match.group('pct') or match.group('secs'))
+        if self.phase not in OBJECTIVE_PHASES:
+            raise TesterError('invalid objective {!r}, unknown phase {}, '
+                              'expected one of {}'.format(
+                                  spec, self.phase,
+                                  ', '.join(OBJECTIVE_PHASES)))
+        if self.relative and self.stat not in HISTORY_STATS:
+            raise TesterError('invalid objective {!r}, relative objectives '
+                              'need one of {}'.format(
+                                  spec, ', '.join(HISTORY_STATS)))
+        if self.stat != 'max' and not 0 < int(self.stat[1:]) <= 100:
+            raise TesterError('invalid objective {!r}, percentile out of '
+                              'range'.format(spec))
+
+    def value(self, report):
+        '''The statistic of the phase in report, None without samples'''
+        values = [x[self.phase] for x in report.rows if self.phase in x]
+        if not values:
+            return None
+        if self.stat == 'max':
+            return max(values)
+        return percentile(values, int(self.stat[1:]))
+
+    def check(self, report, baseline=None):
+        '''Returns a description of the breach, None if met'''
+        value = self.value(report)
+        if value is None:
+            LOG.warning('Objective %s: no %s samples', self.spec, self.phase)
+            return None
+        if not self.relative:
+            limit = self.limit
+        elif baseline is None:
+            LOG.warning('Objective %s: no history to compare to yet',
+                        self.spec)
+            return None
+        else:
+            limit = baseline * (1 + self.limit / 100.0)
+        LOG.info('Objective %s: %.1fs, limit %.1fs', self.spec, value, limit)
+        if value > limit:
+            return '{} {} {:.1f}s exceeds {:.1f}s ({})'.format(
+                self.phase, self.stat, value, limit, self.spec)
+        return None
+
+
+class History(object):
+    '''JSON lines of the phase statistics of past runs that met their
+    objectives'''
+
+    def __init__(self, path=None):
+        self.path = path or default_history_path()
+
+    def runs(self, key, since=0):
+        try:
+            with open(self.path) as f:
+                lines = f.readlines()
+        except (IOError, OSError):
+            return []
+        ret = []
+        for line in lines:
+            try:
+                run = json.loads(line)
+            except ValueError:
+                continue
+            if run.get('time', 0) >= since and all(
+                    run.get(k) == v for k, v in key.items()):
+                ret.append(run)
+        return ret
+
+    def baseline(self, key, phase, stat, days=7):
+        '''Median of a statistic over the runs of the last days'''
+        values = []
+        for run in self.runs(key, time.time() - days * 86400):
+            value = run.get('phases', {}).get(phase, {}).get(stat)
+            if value is not None:
+                values.append(value)
+        return percentile(values, 50)
+
+    def append(self, key, report):
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname, 0o700)
+        run = dict(key, time=time.time(), servers=len(report.rows),
+                   phases=report.aggregate())
+        # A single short write, so concurrent runs do not mix their lines
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(run, sort_keys=True) + '\n')
+
+
+def check_run(test, objectives=(), history=None, days=7):
+    '''Check a passed test against objectives and record it to history
+
+    Runs that miss an objective are not recorded, so that regressions do
+    not move the baseline. Returns the descriptions of the objectives that
+    were missed.
+    '''
+    report = TimingReport(test.tracked.values())
+    key = run_key(test)
+    breaches = []
+    for objective in objectives:
+        baseline = None
+        if objective.relative and history is not None:
+            baseline = history.baseline(key, objective.phase, objective.stat,
+                                        days)
+        breach = objective.check(report, baseline)
+        if breach is not None:
+            LOG.error('Objective missed: %s', breach)
+            breaches.append(breach)
+    if history is not None and not breaches:
+        history.append(key, report)
+    return breaches
@@ -0,0 +1,131 @@
+from __future__ import print_function, unicode_literals
+
+import collections
+import logging
+
+from os_nova_servertester.pool import run_concurrently
+from os_nova_servertester.report import monotonic, percentile, phase_durations
+from os_nova_servertester.tests import SimpleTest
+
+LOG = logging.getLogger(__name__)
+
+
+class SoakTest(SimpleTest):
+    '''Keeps provisioning servers at a sustained rate
+
+    New servers are created at rate servers per minute as long as fewer
+    than max_inflight are in progress. Each server is torn down as soon as
+    it has called home or failed, and success rate and latencies over the
+    last window seconds are logged every report_interval seconds. Runs
+    until duration seconds have passed, or until interrupted if no
+    duration is given.
+    '''
+
+    def __init__(self, auth, image, flavor, rate=10, max_inflight=50,
+                 duration=None, report_interval=60, window=300, **kwargs):
+        super(SoakTest, self).__init__(auth, image, flavor, **kwargs)
+        self.rate = float(rate)
+        self.max_inflight = max_inflight
+        self.duration = duration
+        self.report_interval = report_interval
+        self.window = window
+        self.created = 0
+        self.skipped = 0
+        self.outcomes = collections.deque()
+        self.totals = collections.Counter()
+
+    def state_create_servers(self):
+        '''Start the sustained load'''
+        self.add_server_rollbacks()
+        self.start_journal()
+        self.next_state(self.state_soak)
+
+    def create_batch(self, count):
+        results = run_concurrently(
+            lambda i: self.create_server(
+                '{}{}'.format(self.server_name_prefix, i)),
+            range(self.created + 1, self.created + count + 1),
+            self.create_concurrency)
+        self.created += count
+        for _, _, e in results:
+            if e is not None:
+                LOG.error("error while creating server: %s", e)
+                if self.metrics is not None:
+                    self.metrics.create_failed()
+                self.record(monotonic(), False, {})
+
+    def record(self, now, ok, durations):
+        self.outcomes.append((now, ok, durations))
+        self.totals['ok' if ok else 'failed'] += 1
+
+    def collect_finished(self):
+        '''Move torn down servers from tracking into the rolling window'''
+        now = monotonic()
+        for tracked in list(self.tracked.values()):
+            if tracked.done and (tracked.deleted or tracked.error):
+                del self.tracked[tracked.id]
+                if self.callhome is not None:
+                    self.callhome.discard(tracked.id)
+                self.record(now, tracked.error is None,
+                            phase_durations(tracked.timestamps))
+        while self.outcomes and self.outcomes[0][0] < now - self.window:
+            self.outcomes.popleft()
+
+    def log_window(self):
+        ok = len([x for x in self.outcomes if x[1]])
+        total = len(self.outcomes)
+        stats = []
+        for phase in ('build', 'callhome'):
+            values = [x[2][phase] for x in self.outcomes if phase in x[2]]
+            if values:
+                stats.append('{} p50={:.1f}s p90={:.1f}s'.format(
+                    phase, percentile(values, 50), percentile(values, 90)))
+        LOG.info('Soak: created %d, in flight %d, skipped %d, last %ds: '
+                 'success %s (%d/%d) %s', self.created, len(self.tracked),
+                 self.skipped, self.window,
+                 '{:.1f}%'.format(100.0 * ok / total) if total else '-',
+                 ok, total, ' '.join(stats))
+
+    def state_soak(self):
+        '''Create servers at the target rate and recycle them'''
+        start = monotonic()
+        interval = 60.0 / self.rate
+        next_create = start
+        next_report = start + self.report_interval
+        last_poll = None
+        while True:
+            now = monotonic()
+            running = not self.duration or now - start < self.duration
+            if not running and not self.tracked:
+                break
+            due = 0
+            while running and next_create <= now:
+                next_create += interval
+                due += 1
+            room = self.max_inflight - len(
+                [x for x in self.tracked.values() if not x.done])
+            if due > room:
+                self.skipped += due - max(room, 0)
+                due = max(room, 0)
+            if due:
+                self.create_batch(due)
+
+            poll_metadata = (
+                self.callhome is None or last_poll is None or
+                now - last_poll >= self.callhome_fallback_interval)
+            if poll_metadata:
+                last_poll = now
+            pending = self.advance_servers(poll_metadata)
+            self.collect_finished()
+            if now >= next_report:
+                next_report = now + self.report_interval
+                self.log_window()
+            if not running and not pending:
+                break
+            delay = self.poll_interval
+            if running:
+                delay = max(min(delay, next_create - monotonic()), 0)
+            self.sleep(delay)
+        self.log_window()
+        LOG.info('Soak: finished, %d ok, %d failed, %d skipped',
+                 self.totals['ok'], self.totals['failed'], self.skipped)
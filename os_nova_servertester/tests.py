@@ -1,23 +1,72 @@
 from __future__ import print_function, unicode_literals
 
 import datetime as dt
+import gzip
 import logging
 import os
 import sys
-import time
+import threading
+import uuid
+from collections import OrderedDict
 
 import six
-from keystoneauth1.session import Session
-from novaclient.client import Client
-from novaclient.exceptions import NotFound as NovaNotFound
 
+from os_nova_servertester import trace
+from os_nova_servertester.console import DEFAULT_FAIL_PATTERNS, ConsoleWatcher
 from os_nova_servertester.errors import TesterError, TimeOut
-from os_nova_servertester.server import shim
-from os_nova_servertester.server.cloudconfig import CloudConfigGenerator
+from os_nova_servertester.journal import RunJournal
+from os_nova_servertester.poll import PollScheduler, RateLimiter, ServerView
+from os_nova_servertester.pool import run_concurrently
+from os_nova_servertester.quota import headroom
+from os_nova_servertester.report import TimingReport, monotonic
+from os_nova_servertester.server import shim, userdata
+from os_nova_servertester.server.callhome import CallhomeReceiver
 
 LOG = logging.getLogger(__name__)
 
 
+# The client stack is slow to import, so it is only loaded once a test
+# actually talks to the API and commands like --help stay fast
+def nova_exceptions():
+    from novaclient import exceptions
+    return exceptions
+
+
+def rate_limit_errors():
+    '''413 and 429 responses, the latter only exists in newer novaclients'''
+    exceptions = nova_exceptions()
+    return tuple(getattr(exceptions, x) for x in ('OverLimit', 'RateLimit')
+                 if hasattr(exceptions, x))
+
+
+def make_client(auth, api_timeout=60, pool_size=10, version='2',
+                tracer=None, region_name=None):
+    '''Nova client with a connection pool for pool_size threads
+
+    The client's connection_stats count requests and new connections. With
+    a tracer every request is recorded to it.
+    '''
+    from novaclient.client import Client
+
+    from os_nova_servertester.connpool import make_session
+    session, stats = make_session(auth, pool_size, tracer)
+    client = Client(version, session=session, timeout=api_timeout,
+                    region_name=region_name)
+    client.connection_stats = stats
+    return client
+
+
+def is_active(server):
+    '''ACTIVE and done, a rebuild is ACTIVE for a moment when it starts'''
+    return (server.status == 'ACTIVE' and
+            not getattr(server, 'OS-EXT-STS:task_state', None))
+
+
+def pool_size_for(*concurrencies):
+    '''Connections needed by worker threads plus the polling thread'''
+    return max(concurrencies) + 2
+
+
 class StopWorkFlow(RuntimeError):
     pass
 
@@ -30,16 +79,28 @@ class TestWorkFlow(object):
 
     def __init__(self):
         self.current_state = None
+        # Name of the state or rollback being executed
+        self.state_name = None
         self.rollback_cbs = []
         self._outcome = self.PENDING
+        self.abort_requested = threading.Event()
 
     def next_state(self, nxt):
         self.current_state = nxt
 
+    def abort(self):
+        '''Ask a workflow running in another thread to abort'''
+        self.abort_requested.set()
+
+    def check_abort(self):
+        if self.abort_requested.is_set():
+            raise KeyboardInterrupt('aborted')
+
     def cleanup(self):
         for func in reversed(self.rollback_cbs):
             LOG.info('%s: executing rollback: %s (%s)',
                      self.__class__.__name__, func.__name__, func.__doc__)
+            self.state_name = 'rollback_' + func.__name__
             func()
 
     def add_rollback(self, cb):
@@ -63,8 +124,10 @@ class TestWorkFlow(object):
                     break
                 func = self.current_state
                 self.current_state = None
+                self.check_abort()
                 LOG.info('%s: executing: %s (%s)', self.__class__.__name__,
                          func.__name__, func.__doc__)
+                self.state_name = func.__name__
                 func()
                 LOG.info('%s: completed: %s (%s)', self.__class__.__name__,
                          func.__name__, func.__doc__)
@@ -88,17 +151,88 @@ class TestWorkFlow(object):
         self.outcome = self.COMPLETE
 
 
+class ServerWorkFlow(object):
+    '''Tracks a single server thru its own states
+
+    Servers move created -> active -> called-home -> logs-saved ->
+    deleting -> deleted independently of each other. A failing server moves
+    to failed and from there to logs-saved and deleted like the others.
+    '''
+    CREATED = 'created'
+    ACTIVE = 'active'
+    CALLED_HOME = 'called-home'
+    FAILED = 'failed'
+    LOGS_SAVED = 'logs-saved'
+    DELETING = 'deleting'
+    DELETED = 'deleted'
+
+    def __init__(self, server, requested=None, listener=None):
+        self.server = server
+        self.id = server.id
+        self.state = self.CREATED
+        self.since = monotonic()
+        self.error = None
+        self.timed_out = False
+        # Timings measured and reported by the shim inside the server
+        self.guest_timings = {}
+        # Called with (tracker, state) the first time a state is entered
+        self.listener = listener
+        # First time each state was entered, for the timing report
+        self.timestamps = {self.CREATED: self.since}
+        if requested is not None:
+            self.timestamps['requested'] = requested
+        if listener is not None:
+            listener(self, self.CREATED)
+
+    def transition(self, state):
+        LOG.debug('Server %s: %s -> %s', self.id, self.state, state)
+        self.state = state
+        self.since = monotonic()
+        if state not in self.timestamps:
+            self.timestamps[state] = self.since
+            if self.listener is not None:
+                self.listener(self, state)
+
+    def fail(self, error, timed_out=False):
+        LOG.error('Server %s: %s', self.id, error)
+        self.error = error
+        self.timed_out = timed_out
+        self.transition(self.FAILED)
+
+    @property
+    def finished(self):
+        '''Server is ready for log collection and teardown'''
+        return self.state in (self.CALLED_HOME, self.FAILED)
+
+    @property
+    def passed(self):
+        '''Server called home successfully, whatever state it is in now'''
+        return self.error is None and self.CALLED_HOME in self.timestamps
+
+    @property
+    def done(self):
+        return self.state in (self.LOGS_SAVED, self.DELETING, self.DELETED)
+
+    @property
+    def deleted(self):
+        '''Deletion has been at least requested'''
+        return self.state in (self.DELETING, self.DELETED)
+
+
 class SimpleTest(TestWorkFlow):
-    TEST_STATUS_KEY = 'SimpleTestStatus'
-    TEST_STATUS_PENDING = 'pending'
-    TEST_STATUS_COMPLETE = 'complete'
-    TEST_STATUS_ERROR = 'error'
+    TEST_STATUS_KEY = userdata.TEST_STATUS_KEY
+    TEST_STATUS_PENDING = userdata.TEST_STATUS_PENDING
+    TEST_STATUS_COMPLETE = userdata.TEST_STATUS_COMPLETE
+    TEST_STATUS_ERROR = userdata.TEST_STATUS_ERROR
 
-    TEST_STATUS_EXITCODE_KEY = 'SimpleTestExitStatus'
+    TEST_STATUS_EXITCODE_KEY = userdata.TEST_STATUS_EXITCODE_KEY
+    TEST_TIMINGS_KEY = userdata.TEST_TIMINGS_KEY
 
-    TEST_SHIM = '/run_test.sh'
-    USER_TEST_SCRIPT = '/user_test.sh'
+    TEST_SHIM = userdata.TEST_SHIM
+    USER_TEST_SCRIPT = userdata.USER_TEST_SCRIPT
     SHELL = '/bin/bash'
+    # Compute API microversion of the client the test makes
+    API_VERSION = '2'
 
     def __init__(self,
                  auth,
@@ -115,10 +249,56 @@ class SimpleTest(TestWorkFlow):
                  shim_type='bash',
                  cloud_init_type='cloud-init',
                  no_cleanup_on_error=False,
+                 poll_interval=1,
+                 poll_max_interval=10,
+                 poll_backoff=1.5,
+                 poll_jitter=0.1,
+                 poll_resync_interval=60,
+                 expected_build_time=None,
+                 expected_callhome_time=None,
+                 api_rate_limit=0,
+                 rate_limiter=None,
+                 create_concurrency=1,
+                 multi_create=False,
+                 quota_waves=True,
+                 callhome_mode='metadata',
+                 callhome_listen='0.0.0.0:0',
+                 callhome_url=None,
+                 callhome_fallback_interval=30,
+                 pipeline=False,
+                 delete_concurrency=1,
+                 wait_for_delete=False,
+                 delete_timeout=300,
+                 console_log_concurrency=1,
+                 console_log_lines=None,
+                 console_log_compress=False,
+                 console_tail_interval=None,
+                 console_tail_lines=50,
+                 console_fail_patterns=None,
+                 report_json=None,
+                 report_csv=None,
+                 resolve_cache=None,
+                 userdata_cache=None,
+                 compress_userdata=False,
+                 metrics=None,
+                 tracer=None,
+                 journal_dir=None,
+                 resume=None,
+                 callhome=None,
+                 client=None,
                  **kwargs):
         super(SimpleTest, self).__init__(**kwargs)
-        self.client = Client(
-            '2', session=Session(auth=auth), timeout=api_timeout)
+        # Only a client of our own has connection stats just for this run
+        self.owns_client = client is None
+        if client is None:
+            client = make_client(auth, api_timeout, pool_size_for(
+                create_concurrency, delete_concurrency,
+                console_log_concurrency), self.API_VERSION, tracer)
+            if metrics is not None:
+                metrics.add_connection_stats(client.connection_stats)
+        self.client = client
+        self.auth = auth
+        self.resolve_cache = resolve_cache
         self.image = image
         self.flavor = flavor
         self.network = network
@@ -133,157 +313,806 @@ class SimpleTest(TestWorkFlow):
         else:
             self.console_logs = None
         self.servers = []
+        self.tracked = OrderedDict()
         self.userdata = None
         self.shim_type = shim_type
         self.cloud_init_type = cloud_init_type
         self.no_cleanup_on_error = no_cleanup_on_error
+        self.poll_interval = poll_interval
+        self.poll_max_interval = poll_max_interval
+        self.poll_backoff = poll_backoff
+        self.poll_jitter = poll_jitter
+        self.server_view = ServerView(self.list_servers, poll_resync_interval)
+        self.expected_build_time = expected_build_time
+        self.expected_callhome_time = expected_callhome_time
+        # Tests sharing a client should share its request budget too
+        if rate_limiter is None:
+            rate_limiter = RateLimiter(api_rate_limit)
+        self.rate_limiter = rate_limiter
+        self.create_concurrency = create_concurrency
+        self.multi_create = multi_create
+        self.quota_waves = quota_waves
+        # Names of servers waiting for quota to be created
+        self.queued = []
+        self.quota_blocked_since = None
+        self.callhome_mode = callhome_mode
+        self.callhome_listen = callhome_listen
+        self.callhome_url = callhome_url
+        self.callhome_fallback_interval = callhome_fallback_interval
+        self.callhome = callhome
+        self.userdata_cache = userdata_cache
+        self.compress_userdata = compress_userdata
+        self.metrics = metrics
+        self.tracer = tracer
+        self.console_tail_interval = console_tail_interval
+        self.console_tail_lines = console_tail_lines
+        self.console_watcher = None
+        if console_tail_interval:
+            self.console_watcher = ConsoleWatcher(
+                console_fail_patterns or DEFAULT_FAIL_PATTERNS)
+        self.last_console_tail = None
+        if compress_userdata and cloud_init_type != 'cloud-init':
+            LOG.warning('Userdata compression is only supported with '
+                        'cloud-init, ignoring')
+            self.compress_userdata = False
+        self.pipeline = pipeline
+        self.delete_concurrency = delete_concurrency
+        self.wait_for_delete = wait_for_delete
+        self.delete_timeout = delete_timeout
+        self.undeleted_servers = []
+        self.console_log_concurrency = console_log_concurrency
+        self.console_log_lines = console_log_lines
+        self.console_log_compress = console_log_compress
+        self.report_json = report_json
+        self.report_csv = report_csv
+        self.resume = resume
+        self.journal = None
+        if resume is not None:
+            self.run_id = resume.run_id
+            self.server_name_prefix = resume.prefix
+            self.journal = RunJournal(resume.path)
+            # Adopted servers are in different states, which only the
+            # pipelined workflow handles
+            self.pipeline = True
+        else:
+            self.run_id = uuid.uuid4().hex[:8]
+            self.server_name_prefix = 'test-server-{}-{}-'.format(
+                self.__class__.__name__, self.run_id)
+            if journal_dir is not None:
+                self.journal = RunJournal.for_run(self.run_id, journal_dir)
         self.next_state(self.state_prepare)
 
+    API_RETRIES = 5
+
+    def api_call(self, func, *args, **kwargs):
+        '''Call the API within the request budget
+
+        Rate limit responses slow everybody sharing the budget down and the
+        call is retried instead of failing.
+        '''
+        for attempt in range(self.API_RETRIES + 1):
+            self.rate_limiter.acquire()
+            try:
+                # Worker threads tag their requests with our state too
+                with trace.context(self.tracer, self):
+                    ret = self.timed_call(func, *args, **kwargs)
+                self.rate_limiter.success()
+                return ret
+            except rate_limit_errors() as e:
+                # A 413 without Retry-After is a quota error, not throttling
+                retry_after = getattr(e, 'retry_after', None)
+                if attempt == self.API_RETRIES or (
+                        getattr(e, 'code', None) == 413 and not retry_after):
+                    raise
+                delay = self.rate_limiter.throttle(retry_after)
+                LOG.warning('Rate limited by the API (%s), backing off %.1fs',
+                            e, delay)
+
+    def abort(self):
+        super(SimpleTest, self).abort()
+        # A shared receiver wakes the other tests too, for an early poll
+        if self.callhome is not None:
+            self.callhome.wake()
+
+    def begin(self):
+        with trace.context(self.tracer, self):
+            return super(SimpleTest, self).begin()
+
+    def timed_call(self, func, *args, **kwargs):
+        '''Call func and record its latency in the metrics'''
+        if self.metrics is None:
+            return func(*args, **kwargs)
+        name = getattr(func, '__name__', 'call')
+        start = monotonic()
+        try:
+            ret = func(*args, **kwargs)
+        except Exception:
+            self.metrics.api_call(name, monotonic() - start, True)
+            raise
+        self.metrics.api_call(name, monotonic() - start)
+        return ret
+
+    def poll_scheduler(self, expected=None):
+        return PollScheduler(
+            initial=self.poll_interval,
+            maximum=self.poll_max_interval,
+            factor=self.poll_backoff,
+            jitter=self.poll_jitter,
+            expected=expected)
+
+    def poll_wait(self, scheduler, progress):
+        '''Sleep until the next polling round or a pushed callhome report'''
+        self.sleep(scheduler.next_delay(progress))
+
+    def sleep(self, delay):
+        '''Sleep until delay passes, a callhome report arrives or abort'''
+        self.wait_wakeup(delay)
+        self.check_abort()
+
+    def wait_wakeup(self, delay):
+        '''Like sleep, but returns on abort instead of raising'''
+        if self.callhome is not None:
+            self.callhome.wait(delay, self.abort_requested)
+        else:
+            self.abort_requested.wait(delay)
+
+    def list_servers(self, changes_since=None):
+        '''List servers of this run with a single detailed list call'''
+        search_opts = {'name': '^' + self.server_name_prefix}
+        if changes_since is not None:
+            search_opts['changes-since'] = changes_since
+        return self.api_call(
+            self.client.servers.list,
+            detailed=True,
+            search_opts=search_opts,
+            limit=-1)
+
+    def poll_servers(self, server_ids, full=False):
+        '''Current state of the given servers
+
+        Only servers changed since the previous round are fetched, unless
+        full is set, which is needed to see fresh metadata. Servers that
+        Nova does not list are omitted.
+        '''
+        return self.server_view.get(server_ids, full)
+
+    def track_server(self, server, requested=None):
+        '''Start tracking a created server so that it gets rolled back'''
+        tracked = self.tracked[server.id] = ServerWorkFlow(
+            server, requested, listener=self.server_transition)
+        return tracked
+
+    def server_transition(self, tracked, state):
+        if self.journal is not None:
+            self.journal.server(tracked.id, state)
+        if self.metrics is not None:
+            self.metrics.server_transition(tracked, state)
+
+    def update_server(self, server):
+        '''Store a fresh copy of server and return its tracker'''
+        tracked = self.tracked[server.id]
+        tracked.server = server
+        return tracked
+
+    def save_server_log(self, tracked):
+        if self.console_logs is not None:
+            try:
+                log = self.api_call(tracked.server.get_console_output,
+                                    length=self.console_log_lines)
+                name = "console-output-{}.txt".format(tracked.id)
+                opener = open
+                if self.console_log_compress:
+                    name += '.gz'
+                    opener = gzip.open
+                with opener(os.path.join(self.console_logs, name), 'wb') as f:
+                    f.write(log.encode('utf-8'))
+            except Exception as e:
+                LOG.error("error while saving logs: %s", e)
+        tracked.transition(tracked.LOGS_SAVED)
+
+    def tail_console(self, tracked):
+        output = self.api_call(tracked.server.get_console_output,
+                               length=self.console_tail_lines)
+        return self.console_watcher.check(tracked.id, output)
+
+    def tail_consoles(self, trackers):
+        '''Fail servers whose new console output matches a failure pattern
+
+        Consoles are fetched at most every console_tail_interval seconds.
+        Returns the servers that failed.
+        '''
+        if self.console_watcher is None:
+            return []
+        # Servers no longer waited for are done with their console
+        waiting = set(x.id for x in trackers)
+        for server_id in list(self.console_watcher.tails):
+            if server_id not in waiting:
+                self.console_watcher.forget(server_id)
+        now = monotonic()
+        if not trackers or (
+                self.last_console_tail is not None and
+                now - self.last_console_tail < self.console_tail_interval):
+            return []
+        self.last_console_tail = now
+        failed = []
+        for tracked, line, e in run_concurrently(
+                self.tail_console, trackers, self.console_log_concurrency):
+            if e is not None:
+                LOG.debug('Server %s: cannot fetch console: %s', tracked.id,
+                          e)
+            elif line is not None:
+                tracked.fail('console: {}'.format(line))
+                failed.append(tracked)
+        return failed
+
+    def save_server_logs(self, trackers):
+        '''Fetch console logs concurrently, writing each as it arrives'''
+        run_concurrently(self.save_server_log, trackers,
+                         self.console_log_concurrency)
+
+    def leftover_servers(self):
+        '''Servers this run may leave behind'''
+        undeleted = set(x.id for x in self.undeleted_servers)
+        return [x for x in self.tracked.values()
+                if not x.deleted or x.id in undeleted]
+
+    def delete_server(self, tracked):
+        self.api_call(self.client.servers.delete, tracked.server)
+        tracked.transition(tracked.DELETING)
+
+    def delete_servers(self, trackers):
+        '''Delete servers concurrently and optionally wait until gone'''
+        results = run_concurrently(self.delete_server, trackers,
+                                   self.delete_concurrency)
+        for tracked, _, e in results:
+            if e is not None:
+                LOG.error("Server %s: error while deleting: %s", tracked.id,
+                          e)
+        self.confirm_deletion()
+
+    def confirm_deletion(self):
+        '''Wait until nova no longer lists servers that are being deleted'''
+        if not self.wait_for_delete:
+            return
+        wait_ids = set(x.id for x in self.tracked.values()
+                       if x.state == ServerWorkFlow.DELETING)
+        if not wait_ids:
+            return
+        start = dt.datetime.now()
+        scheduler = self.poll_scheduler()
+        while wait_ids:
+            # Deleted servers drop out of a full listing
+            polled = self.poll_servers(wait_ids, True)
+            remaining = dict((x.id, x) for x in polled
+                             if x.status != 'DELETED')
+            gone = wait_ids - set(remaining)
+            for server_id in gone:
+                self.tracked[server_id].transition(ServerWorkFlow.DELETED)
+            wait_ids = set(remaining)
+            if not wait_ids:
+                break
+            if (dt.datetime.now() - start).seconds > self.delete_timeout:
+                self.undeleted_servers = list(remaining.values())
+                for server in self.undeleted_servers:
+                    LOG.error("Server %s: refused to delete: status %s %s",
+                              server.id, server.status,
+                              vars(server).get('fault', ''))
+                break
+            # Cleanup runs after an abort too, so stop waiting instead of
+            # raising
+            if self.abort_requested.is_set():
+                LOG.warning("Aborted, not waiting for %d servers to go away",
+                            len(wait_ids))
+                break
+            self.wait_wakeup(scheduler.next_delay(bool(gone)))
+        if not wait_ids:
+            LOG.info("All deleted servers are gone")
+
+    def resolution_scope(self):
+        '''Identifies the cloud and project for the resolution cache'''
+        http = self.client.client
+        project = getattr(http, 'get_project_id', lambda: None)()
+        return '{}|{}'.format(
+            getattr(self.auth, 'auth_url', None) or http.get_endpoint(),
+            project)
+
+    def resolve(self, kind, name, lookup, get=None):
+        '''Resolve name with lookup, using the resolution cache
+
+        A cached id is validated with get (lookup by default), which should
+        be a cheap call by id, and discarded if the name no longer matches.
+        '''
+        if self.resolve_cache is None:
+            return lookup(name)
+        scope = self.resolution_scope()
+        cached = self.resolve_cache.get(scope, kind, name)
+        if cached is not None:
+            try:
+                resource = (get or lookup)(cached)
+                if name in (resource.id, getattr(resource, 'name', None),
+                            getattr(resource, 'label', None)):
+                    LOG.debug('Resolved %s %s from cache', kind, name)
+                    return resource
+            except nova_exceptions().NotFound:
+                pass
+            self.resolve_cache.invalidate(scope, kind, name)
+        resource = lookup(name)
+        self.resolve_cache.put(scope, kind, name, resource.id)
+        return resource
+
+    def find_network(self, name_or_id):
+        try:
+            return self.client.neutron.find_network(name_or_id)
+        except nova_exceptions().NotFound:
+            # Newer novaclients no longer have the nova-network proxy
+            if not hasattr(self.client, 'networks'):
+                raise
+            return self.client.networks.get(name_or_id)
+
+    def find_flavor(self, name):
+        return self.client.flavors.find(name=name)
+
     def state_prepare(self):
         '''Checks nova connectivity and validates parameters'''
+        # Images and networks are found with a cheap query by name, only
+        # flavors need the whole list and are worth caching
         self.image = self.client.glance.find_image(self.image)
         LOG.info('Image: %s %s', self.image.id, self.image.name)
         if self.network is not None and self.network != 'auto':
-            try:
-                self.network = self.client.neutron.find_network(self.network)
-                netname = self.network.name
-            except NovaNotFound:
-                self.network = self.client.networks.get(self.network)
-                netname = self.network.label
+            self.network = self.find_network(self.network)
+            netname = getattr(self.network, 'name', None) or \
+                self.network.label
             LOG.info('Network: %s %s', self.network.id, netname)
-        self.flavor = self.client.flavors.find(name=self.flavor)
+        self.flavor = self.resolve('flavor', self.flavor, self.find_flavor,
+                                   self.client.flavors.get)
         LOG.info('Flavor: %s %s', self.flavor.id, self.flavor.name)
         self.next_state(self.state_prepare_userdata)
 
     def state_prepare_userdata(self):
         '''Prepare userdata scripts that allow server to report its state'''
+        if self.callhome_mode == 'push':
+            if self.callhome is None:
+                self.callhome = CallhomeReceiver(
+                    self.callhome_listen, self.callhome_url,
+                    uuid.uuid4().hex)
+                self.add_rollback(self.callhome.stop)
+                self.callhome.start(self.client.client.get_endpoint())
+        elif self.callhome_mode != 'metadata':
+            raise TesterError('unsupported callhome mode: {}'.format(
+                self.callhome_mode))
+
         test_script_content = ''
         if self.test_script:
             with open(self.test_script) as f:
                 test_script_content = f.read()
 
-        shimscript = shim.get_script(
-            self.client.client.get_token(),
-            self.client.client.get_endpoint(),
-            self.USER_TEST_SCRIPT,
-            self.TEST_STATUS_KEY,
-            self.TEST_STATUS_COMPLETE,
-            self.TEST_STATUS_ERROR,
-            self.TEST_STATUS_EXITCODE_KEY,
-            test_script_content=test_script_content,
-            script_type=self.shim_type)
-        if self.cloud_init_type == 'cloud-init':
-            cconfig = CloudConfigGenerator()
-            # Ensure curl is installed
-            cconfig.add_write_file(self.TEST_SHIM, shimscript, mode='0750')
-            if self.test_script:
-                cconfig.add_write_file(
-                    self.USER_TEST_SCRIPT, test_script_content, mode='0750')
-            if self.shim_type == 'bash':
-                cconfig.add_package('curl')
-                cconfig.add_runcmd('/bin/bash', self.TEST_SHIM)
-            elif self.shim_type == 'powershell':
-                cconfig.add_runcmd('/usr/bin/env', 'powershell', '-File',
-                                   self.TEST_SHIM)
-            else:
-                raise TesterError('unsupported shim type: {}'.format(
-                    self.shim_type))
-            self.userdata = cconfig.generate()
-        elif self.cloud_init_type == 'cloudbase-init':
-            userdata = []
-            userdata.append('#ps1_sysnative')
-            userdata.append(shimscript)
-            self.userdata = "\n".join(userdata)
+        if self.userdata_cache is None:
+            self.userdata = self.render_userdata(test_script_content)
         else:
-            raise TesterError('Unsupported cloud-init type: {}'.format(
-                self.cloud_init_type))
+            template = shim.TPL_PS if self.shim_type == 'powershell' \
+                else shim.TPL_BASH
+            key = self.userdata_cache.key(
+                self.client.client.get_token(),
+                self.client.client.get_endpoint(), test_script_content,
+                template.template, self.shim_type, self.cloud_init_type,
+                self.compress_userdata, self.callhome and self.callhome.url,
+                self.callhome and self.callhome.token)
+            self.userdata = self.userdata_cache.get(key)
+            if self.userdata is None:
+                self.userdata = self.render_userdata(test_script_content)
+                self.userdata_cache.put(key, self.userdata)
+            else:
+                LOG.info('Using cached userdata')
+
+        raw, encoded = userdata.check_size(self.userdata)
+        LOG.info('Userdata: %d bytes, %d bytes encoded (limit %d)',
+                 raw, encoded, userdata.USERDATA_LIMIT)
         self.next_state(self.state_create_servers)
 
-    def state_create_servers(self):
-        '''Creates test servers according to configuration'''
-        servers = []
+    def render_userdata(self, test_script_content):
+        return userdata.render(
+            self.client.client.get_token(),
+            self.client.client.get_endpoint(),
+            test_script_content=test_script_content,
+            shim_type=self.shim_type,
+            cloud_init_type=self.cloud_init_type,
+            compress=self.compress_userdata,
+            callhome_url=self.callhome and self.callhome.url,
+            callhome_token=self.callhome and self.callhome.token)
 
+    def add_server_rollbacks(self):
+        '''Register rollbacks that save logs, delete servers and report'''
         def save_logs():
             if self.console_logs is None:
                 return
-            for server in servers:
-                try:
-                    log = server.get_console_output()
-                    name = "console-output-{}.txt".format(server.id)
-                    with open(os.path.join(self.console_logs, name), 'w') as f:
-                        f.write(log)
-                except Exception as e:
-                    LOG.error("error while saving logs: %s", e)
-                    pass
+            self.save_server_logs(
+                [x for x in self.tracked.values() if not x.done])
 
         def delete_servers():
             if self.outcome == self.FAILED and self.no_cleanup_on_error:
                 LOG.info("skipping cleanup")
                 return
-            for server in servers:
-                self.client.servers.delete(server)
+            self.delete_servers(
+                [x for x in self.tracked.values() if not x.deleted])
+
+        def write_report():
+            report = TimingReport(self.tracked.values())
+            report.log_summary()
+            if self.report_json:
+                report.write_json(self.report_json)
+            if self.report_csv:
+                report.write_csv(self.report_csv)
+            stats = getattr(self.client, 'connection_stats', None)
+            if self.owns_client and stats is not None:
+                stats.log_summary()
+
+        def close_journal():
+            if self.journal is not None:
+                outcome = self.outcome
+                if outcome == self.PENDING:
+                    outcome = self.COMPLETE
+                # Nothing left to reap or resume
+                self.journal.close(outcome,
+                                   remove=not self.leftover_servers())
 
+        # Rollbacks run in reverse so the report sees completed deletes
+        self.add_rollback(close_journal)
+        self.add_rollback(write_report)
         self.add_rollback(delete_servers)
+        self.add_rollback(save_logs)
+
+    def server_metadata(self):
+        '''Metadata servers are created with'''
+        return {self.TEST_STATUS_KEY: self.TEST_STATUS_PENDING}
 
+    def create_server(self, name, **kwargs):
+        '''Create and track a server'''
         if self.network is not None and self.network != 'auto':
             nics = [{'net-id': self.network.id}]
         else:
             nics = self.network
-        for i in range(1, self.count + 1):
-            server_name = 'test-server-{}-{}'.format(self.__class__.__name__,
-                                                     i)
-            servers.append(
-                self.client.servers.create(
-                    server_name,
-                    self.image,
-                    self.flavor,
-                    nics=nics,
-                    userdata=self.userdata,
-                    meta={self.TEST_STATUS_KEY: self.TEST_STATUS_PENDING},
-                    availability_zone=self.az, ))
-        LOG.info("Created servers: %s", ' '.join(x.id for x in servers))
-        self.servers = servers[:]
-        self.add_rollback(save_logs)
-        self.next_state(self.state_wait_for_active)
+        requested = monotonic()
+        server = self.api_call(
+            self.client.servers.create,
+            name,
+            self.image,
+            self.flavor,
+            nics=nics,
+            userdata=self.userdata,
+            meta=self.server_metadata(),
+            availability_zone=self.az,
+            **kwargs)
+        # Register for rollback as soon as it exists
+        self.track_server(server, requested)
+        return server
+
+    def start_journal(self):
+        if self.journal is not None:
+            self.journal.start(
+                self.run_id, self.server_name_prefix,
+                image=self.image.id, flavor=self.flavor.name, count=self.count,
+                test=self.__class__.__name__)
+
+    def adopt_servers(self):
+        '''Track the leftover servers of the run being resumed'''
+        listed = OrderedDict((x.id, x) for x in self.list_servers())
+        for server_id in self.resume.leftovers():
+            state = self.resume.servers[server_id]
+            server = listed.pop(server_id, None)
+            if server is None:
+                LOG.info('Server %s: gone, was %s', server_id, state)
+                continue
+            tracked = self.track_server(server)
+            if state == ServerWorkFlow.CALLED_HOME:
+                tracked.transition(state)
+            elif state == ServerWorkFlow.FAILED:
+                tracked.fail('failed before the run was resumed')
+            elif state in (ServerWorkFlow.LOGS_SAVED,
+                           ServerWorkFlow.DELETING):
+                # Deleted again in cleanup, the first delete did not stick
+                tracked.transition(ServerWorkFlow.LOGS_SAVED)
+        # Created but not journaled before the tester was killed
+        for server in listed.values():
+            self.track_server(server)
+        LOG.info('Resuming run %s with %d servers', self.run_id,
+                 len(self.tracked))
+
+    def state_create_servers(self):
+        '''Creates test servers according to configuration'''
+        self.add_server_rollbacks()
+        self.start_journal()
+
+        if self.resume is not None:
+            self.adopt_servers()
+        else:
+            names = self.plan_waves()
+            if self.multi_create and self.count > 1 and not self.queued:
+                self.multi_create_servers()
+            else:
+                self.create_servers(names)
+        self.servers = [x.server for x in self.tracked.values()]
+        LOG.info("Created servers: %s", ' '.join(x.id for x in self.servers))
+        if self.pipeline:
+            self.next_state(self.state_run_servers)
+        else:
+            self.next_state(self.state_wait_for_active)
+
+    def multi_create_servers(self):
+        '''Create all servers with a single request'''
+        # Nova names the servers <name>-<index>, which matches our prefix
+        first = self.create_server(
+            self.server_name_prefix.rstrip('-'),
+            min_count=self.count,
+            max_count=self.count)
+        requested = self.tracked[first.id].timestamps['requested']
+        for server in self.list_servers():
+            if server.id != first.id:
+                self.track_server(server, requested)
+        if len(self.tracked) != self.count:
+            raise TesterError(
+                'multi-create returned {} servers, expected {}'.format(
+                    len(self.tracked), self.count))
+
+    def create_servers(self, names):
+        '''Create servers concurrently, raises if any of them fails'''
+        results = run_concurrently(self.create_server, names,
+                                   self.create_concurrency)
+        errors = [e for _, _, e in results if e is not None]
+        for e in errors:
+            LOG.error("error while creating server: %s", e)
+            if self.metrics is not None:
+                self.metrics.create_failed()
+        if errors:
+            raise TesterError('failed to create {} of {} servers'.format(
+                len(errors), len(names)))
+
+    def quota_headroom(self):
+        '''How many more servers fit in the project quota, None if any'''
+        try:
+            limits = self.api_call(self.client.limits.get)
+        except Exception as e:
+            LOG.warning('Cannot read limits, not checking quota: %s', e)
+            return None
+        return headroom(limits.absolute, self.flavor)
+
+    def plan_waves(self):
+        '''Names of the servers to create first, queues the others
+
+        If the quota does not fit all the servers the run is split into
+        waves. The first one is created right away and the rest one by one
+        as quota frees up, which needs the pipeline.
+        '''
+        names = ['{}{}'.format(self.server_name_prefix, i)
+                 for i in range(1, self.count + 1)]
+        if not self.quota_waves:
+            return names
+        fits = self.quota_headroom()
+        if fits is None or fits >= self.count:
+            return names
+        if fits == 0:
+            raise TesterError('no quota left for a single server')
+        LOG.info('Quota fits %d of %d servers, creating them in waves',
+                 fits, self.count)
+        if not self.pipeline:
+            LOG.info('Waves need the pipeline, enabling it')
+            self.pipeline = True
+        self.queued = names[fits:]
+        return names[:fits]
+
+    def create_wave(self):
+        '''Create queued servers that the quota now has room for'''
+        fits = self.quota_headroom()
+        if fits is None:
+            fits = len(self.queued)
+        if fits <= 0:
+            busy = [x for x in self.tracked.values() if not x.done]
+            if busy:
+                self.quota_blocked_since = None
+            elif self.quota_blocked_since is None:
+                self.quota_blocked_since = monotonic()
+            elif (monotonic() - self.quota_blocked_since >
+                  self.delete_timeout):
+                raise TesterError(
+                    'no quota freed up in {}s, {} servers not created'.format(
+                        self.delete_timeout, len(self.queued)))
+            return
+        self.quota_blocked_since = None
+        names, self.queued = self.queued[:fits], self.queued[fits:]
+        LOG.info('Creating a wave of %d servers, %d still queued',
+                 len(names), len(self.queued))
+        self.create_servers(names)
 
     def state_wait_for_active(self):
         '''Wait until all servers reach ACTIVE status'''
-        wait_servers = self.servers[:]
+        wait_ids = set(x.id for x in self.servers)
         start = dt.datetime.now()
-        while wait_servers:
+        scheduler = self.poll_scheduler(self.expected_build_time)
+        while wait_ids:
             if (dt.datetime.now() - start).seconds > self.build_timeout:
+                for server_id in wait_ids:
+                    self.tracked[server_id].fail(
+                        'timed out while waiting for ACTIVE', True)
                 raise TimeOut(
                     'Timed out while waiting for servers to transition into ACTIVE')
-            server = self.client.servers.get(wait_servers.pop(0))
-            if server.status != 'ACTIVE':
-                wait_servers.append(server)
-            if server.status == 'ERROR':
-                raise TesterError('server in ERROR status: {}'.format(
-                    vars(server).get('fault')))
-            time.sleep(1)
+            progress = False
+            for server in self.poll_servers(wait_ids):
+                if server.status == 'ERROR':
+                    error = 'server in ERROR status: {}'.format(
+                        vars(server).get('fault'))
+                    self.update_server(server).fail(error)
+                    raise TesterError(error)
+                if is_active(server):
+                    self.update_server(server).transition(
+                        ServerWorkFlow.ACTIVE)
+                    wait_ids.discard(server.id)
+                    progress = True
+            if wait_ids:
+                self.poll_wait(scheduler, progress)
         self.next_state(self.state_wait_for_callhome_events)
 
+    def check_callhome(self, server_id, status, exitcode):
+        '''Returns True if the server has completed, raises on error'''
+        if status == self.TEST_STATUS_COMPLETE:
+            LOG.info("Server %s: success", server_id)
+            return True
+        elif status == self.TEST_STATUS_ERROR:
+            LOG.error("Server %s: error code: %s", server_id, exitcode)
+            raise TesterError("Server {} reported error".format(server_id))
+        return False
+
     def state_wait_for_callhome_events(self):
-        '''Wait until all servers have reported ok state thru nova api'''
-        wait_servers = self.servers[:]
+        '''Wait until all servers have reported ok state thru callhome'''
+        wait_ids = set(x.id for x in self.servers)
         start = dt.datetime.now()
-        while wait_servers:
-            if (dt.datetime.now() - start).seconds > self.callhome_timeout:
-                LOG.error("Timed out while waiting for servers: %s",
-                          ', '.join(x.id for x in wait_servers))
+        last_poll = None
+        scheduler = self.poll_scheduler(self.expected_callhome_time)
+        while wait_ids:
+            now = dt.datetime.now()
+            waiting = len(wait_ids)
+            if (now - start).seconds > self.callhome_timeout:
+                for server_id in sorted(wait_ids):
+                    self.tracked[server_id].fail(
+                        'timed out while waiting for callhome', True)
                 raise TimeOut(
                     'Timed out while waiting for servers to call home')
-            server = self.client.servers.get(wait_servers.pop(0))
-            if server.metadata.get(
-                    self.TEST_STATUS_KEY) == self.TEST_STATUS_COMPLETE:
-                LOG.info("Server %s: success", server.id)
+            if self.callhome is not None:
+                for server_id, report in self.callhome.get_reports().items():
+                    if server_id in wait_ids and self.wait_callhome(
+                            self.tracked[server_id], report.get('status'),
+                            report.get('exitcode'), report.get('timings')):
+                        wait_ids.discard(server_id)
+            # In push mode nova metadata is only polled as a slow fallback
+            # for servers that could not reach the receiver
+            if wait_ids and (
+                    self.callhome is None or last_poll is None or
+                    (now - last_poll).seconds >=
+                    self.callhome_fallback_interval):
+                last_poll = now
+                for server in self.poll_servers(wait_ids, True):
+                    if self.wait_callhome(
+                            self.update_server(server),
+                            server.metadata.get(self.TEST_STATUS_KEY),
+                            server.metadata.get(
+                                self.TEST_STATUS_EXITCODE_KEY),
+                            server.metadata.get(self.TEST_TIMINGS_KEY)):
+                        wait_ids.discard(server.id)
+            failed = self.tail_consoles(
+                [self.tracked[x] for x in sorted(wait_ids)])
+            if failed:
+                raise TesterError('Server {} failed: {}'.format(
+                    failed[0].id, failed[0].error))
+            if wait_ids:
+                self.poll_wait(scheduler, len(wait_ids) != waiting)
 
-            elif server.metadata.get(
-                    self.TEST_STATUS_KEY) == self.TEST_STATUS_ERROR:
-                LOG.error("Server %s: error code: %s", server.id,
-                          server.metadata.get(self.TEST_STATUS_EXITCODE_KEY))
-                raise TesterError("Server {} reported error".format(server.id))
+    def advance_servers(self, poll_metadata=True):
+        '''Run one round of the per-server state machines
 
-            else:
-                wait_servers.append(server)
-            time.sleep(1)
+        Returns the number of servers that have not finished yet.
+        '''
+        if self.queued:
+            self.create_wave()
+        building = [x for x in self.tracked.values()
+                    if x.state == ServerWorkFlow.CREATED]
+        booted = [x for x in self.tracked.values()
+                  if x.state == ServerWorkFlow.ACTIVE]
+
+        poll_ids = set(x.id for x in building)
+        if poll_metadata:
+            poll_ids.update(x.id for x in booted)
+        full = poll_metadata and bool(booted)
+        for server in self.poll_servers(poll_ids, full) if poll_ids else []:
+            tracked = self.update_server(server)
+            if tracked.state == ServerWorkFlow.CREATED:
+                if server.status == 'ERROR':
+                    tracked.fail('server in ERROR status: {}'.format(
+                        vars(server).get('fault')))
+                elif is_active(server):
+                    tracked.transition(ServerWorkFlow.ACTIVE)
+            elif tracked.state == ServerWorkFlow.ACTIVE:
+                self.advance_callhome(
+                    tracked, server.metadata.get(self.TEST_STATUS_KEY),
+                    server.metadata.get(self.TEST_STATUS_EXITCODE_KEY),
+                    server.metadata.get(self.TEST_TIMINGS_KEY))
+
+        if self.callhome is not None:
+            for server_id, report in self.callhome.get_reports().items():
+                tracked = self.tracked.get(server_id)
+                if tracked and tracked.state == ServerWorkFlow.ACTIVE:
+                    self.advance_callhome(tracked, report.get('status'),
+                                          report.get('exitcode'),
+                                          report.get('timings'))
+
+        now = monotonic()
+        for tracked in list(self.tracked.values()):
+            if (tracked.state == ServerWorkFlow.CREATED and
+                    now - tracked.since > self.build_timeout):
+                tracked.fail('timed out while waiting for ACTIVE', True)
+            elif (tracked.state == ServerWorkFlow.ACTIVE and
+                  now - tracked.since > self.callhome_timeout):
+                tracked.fail('timed out while waiting for callhome', True)
+
+        self.tail_consoles([x for x in self.tracked.values()
+                            if x.state == ServerWorkFlow.ACTIVE])
+
+        finished = [x for x in self.tracked.values() if x.finished]
+        for tracked, _, e in run_concurrently(self.finish_server, finished,
+                                              self.delete_concurrency):
+            if e is not None:
+                LOG.error("Server %s: error while tearing down: %s",
+                          tracked.id, e)
+
+        return len(self.queued) + len([
+            x for x in self.tracked.values() if x.state in (
+                ServerWorkFlow.CREATED, ServerWorkFlow.ACTIVE)])
+
+    def advance_callhome(self, tracked, status, exitcode, timings=None):
+        '''Move tracked on by its reported status, True once finished'''
+        if timings:
+            # Before the transition so that listeners see them
+            tracked.guest_timings = userdata.parse_timings(timings)
+        try:
+            if self.check_callhome(tracked.id, status, exitcode):
+                tracked.transition(ServerWorkFlow.CALLED_HOME)
+        except TesterError as e:
+            tracked.fail(str(e))
+        return tracked.finished
+
+    def wait_callhome(self, tracked, status, exitcode, timings=None):
+        '''Like advance_callhome, but a reported error fails the test'''
+        if self.advance_callhome(tracked, status, exitcode, timings):
+            if tracked.error is not None:
+                raise TesterError(tracked.error)
+            return True
+        return False
+
+    def finish_server(self, tracked):
+        '''Collect logs and tear down a server that has finished'''
+        self.save_server_log(tracked)
+        if tracked.error is not None and self.no_cleanup_on_error:
+            LOG.info("Server %s: skipping cleanup", tracked.id)
+            return
+        self.delete_server(tracked)
+
+    def state_run_servers(self):
+        '''Advance each server thru its own states until all are done'''
+        last_poll = None
+        pending = None
+        scheduler = self.poll_scheduler(self.expected_build_time)
+        while True:
+            now = dt.datetime.now()
+            # In push mode nova metadata is only polled as a slow fallback
+            poll_metadata = (
+                self.callhome is None or last_poll is None or
+                (now - last_poll).seconds >= self.callhome_fallback_interval)
+            if poll_metadata:
+                last_poll = now
+            waiting, pending = pending, self.advance_servers(poll_metadata)
+            if not pending:
+                break
+            self.poll_wait(scheduler, pending != waiting)
+        self.confirm_deletion()
+        failed = [x for x in self.tracked.values() if x.error is not None]
+        if failed:
+            raise TesterError('{} of {} servers failed: {}'.format(
+                len(failed), len(self.tracked),
+                ', '.join(x.id for x in failed)))
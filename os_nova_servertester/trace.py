@@ -0,0 +1,119 @@
+'''Per-request API tracing
+
+Every HTTP request the client makes is recorded with its latency, status
+and size, tagged with the workflow state that made it, and written out as
+a Chrome trace (chrome://tracing, Perfetto) or as JSON lines.
+'''
+from __future__ import print_function, unicode_literals
+
+import contextlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+from six.moves.urllib.parse import urlsplit
+
+LOG = logging.getLogger(__name__)
+
+# UUIDs, numeric ids and hex ids (tokens, request ids) in URL paths
+ID_RE = re.compile(
+    r'/(?:[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|'
+    r'[0-9]+|[0-9a-f]{32})(?=/|$)')
+
+
+def url_template(url):
+    '''Path of url with ids replaced, so that calls can be grouped'''
+    return ID_RE.sub('/{id}', urlsplit(url).path)
+
+
+class ApiTracer(object):
+    '''Collects a record of each API request'''
+
+    def __init__(self):
+        self.start = time.time()
+        self.records = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def record(self, method, url, status, size, start, seconds):
+        workflow = getattr(self.local, 'workflow', None)
+        parts = urlsplit(url)
+        record = dict(
+            method=method,
+            host=parts.netloc,
+            path=parts.path,
+            template=url_template(url),
+            status=status,
+            bytes=size,
+            start=start,
+            seconds=seconds,
+            thread=threading.current_thread().name,
+            state=getattr(workflow, 'state_name', None),
+            run=getattr(workflow, 'run_id', None))
+        with self.lock:
+            self.records.append(record)
+
+    def chrome_trace(self):
+        '''Records as trace events, one track per thread'''
+        threads = {}
+        events = []
+        with self.lock:
+            records = list(self.records)
+        for x in records:
+            tid = threads.setdefault(x['thread'], len(threads) + 1)
+            events.append(dict(
+                name='{} {}'.format(x['method'], x['template']),
+                cat=x['state'] or 'api',
+                ph='X',
+                ts=int((x['start'] - self.start) * 1e6),
+                dur=int(x['seconds'] * 1e6),
+                pid=os.getpid(),
+                tid=tid,
+                args=dict((k, x[k]) for k in (
+                    'host', 'path', 'status', 'bytes', 'state', 'run'))))
+        for name, tid in threads.items():
+            events.append(dict(name='thread_name', ph='M', pid=os.getpid(),
+                               tid=tid, args=dict(name=name)))
+        return dict(traceEvents=events, displayTimeUnit='ms')
+
+    def write(self, path):
+        '''Write JSON lines if path ends in .jsonl, a Chrome trace if not'''
+        with open(path, 'w') as f:
+            if path.endswith('.jsonl'):
+                with self.lock:
+                    records = list(self.records)
+                for x in records:
+                    f.write(json.dumps(x, sort_keys=True) + '\n')
+            else:
+                json.dump(self.chrome_trace(), f)
+        LOG.info('Wrote trace of %d requests to %s', len(self.records), path)
+
+    def log_summary(self, top=5):
+        '''Log the calls that took the most time in total'''
+        totals = {}
+        with self.lock:
+            for x in self.records:
+                key = '{} {}'.format(x['method'], x['template'])
+                count, seconds = totals.get(key, (0, 0))
+                totals[key] = (count + 1, seconds + x['seconds'])
+        hot = sorted(totals.items(), key=lambda x: x[1][1], reverse=True)
+        for key, (count, seconds) in hot[:top]:
+            LOG.info('Trace: %s: %d calls, %.2fs total, %.3fs mean',
+                     key, count, seconds, seconds / count)
+
+
+@contextlib.contextmanager
+def context(tracer, workflow):
+    '''Tag requests made by this thread with the state of workflow'''
+    if tracer is None:
+        yield
+        return
+    previous = getattr(tracer.local, 'workflow', None)
+    tracer.local.workflow = workflow
+    try:
+        yield
+    finally:
+        tracer.local.workflow = previous
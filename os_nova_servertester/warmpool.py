@@ -0,0 +1,174 @@
+from __future__ import print_function, unicode_literals
+
+import logging
+import threading
+import time
+
+from os_nova_servertester.pool import run_concurrently
+from os_nova_servertester.report import monotonic
+from os_nova_servertester.tests import ServerWorkFlow, SimpleTest
+
+LOG = logging.getLogger(__name__)
+
+POOL_KEY = 'SimpleTestPool'
+POOL_SPEC_KEY = 'SimpleTestPoolSpec'
+POOL_USED_KEY = 'SimpleTestPoolUsed'
+
+# States a server can be rebuilt from
+REBUILDABLE = ('ACTIVE', 'SHUTOFF')
+
+
+def pool_member(server, pool):
+    return (server.metadata or {}).get(POOL_KEY) == pool
+
+
+def last_used(server):
+    try:
+        return float(server.metadata.get(POOL_USED_KEY))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class WarmPoolTest(SimpleTest):
+    '''Reuses a pool of servers kept between runs by rebuilding them
+
+    Pool members carry the pool name in their metadata. Each run rebuilds
+    up to count idle members with the image and freshly rendered userdata,
+    which also resets the callhome metadata, and creates servers only for
+    the rest. Servers that passed are kept for the next run as long as the
+    pool stays within pool_size, others are deleted. Members that have not
+    been used for idle_expiry seconds are deleted when a run starts.
+    Rebuilding with userdata needs compute API microversion 2.57.
+    '''
+
+    API_VERSION = '2.57'
+
+    def __init__(self, auth, image, flavor, pool='default', pool_size=None,
+                 idle_expiry=3600, **kwargs):
+        super(WarmPoolTest, self).__init__(auth, image, flavor, **kwargs)
+        self.pool = pool
+        self.pool_size = pool_size or self.count
+        self.idle_expiry = idle_expiry
+        # Microversions since 2.37 need the network to be explicit
+        if self.network is None:
+            self.network = 'auto'
+        # Servers of this run kept in the pool and the members of others
+        self.pooled = set()
+        self.others = None
+        self.pool_lock = threading.Lock()
+
+    def pool_spec(self):
+        '''What pool members must match to be reused by this run'''
+        return 'flavor={},net={},az={}'.format(
+            self.flavor.id, getattr(self.network, 'id', self.network),
+            self.az or '')
+
+    def server_metadata(self):
+        meta = super(WarmPoolTest, self).server_metadata()
+        meta.update({
+            POOL_KEY: self.pool,
+            POOL_SPEC_KEY: self.pool_spec(),
+            POOL_USED_KEY: '{:.0f}'.format(time.time()),
+        })
+        return meta
+
+    def list_pool(self):
+        prefix = 'test-server-{}-'.format(self.__class__.__name__)
+        return [x for x in self.api_call(self.client.servers.list,
+                                         detailed=True,
+                                         search_opts={'name': '^' + prefix},
+                                         limit=-1)
+                if pool_member(x, self.pool)]
+
+    def expire_idle(self, members):
+        '''Delete members idle for too long, returns the others'''
+        now = time.time()
+        expired = [x for x in members
+                   if now - last_used(x) > self.idle_expiry]
+        for server, _, e in run_concurrently(
+                lambda x: self.api_call(self.client.servers.delete, x),
+                expired, self.delete_concurrency):
+            if e is None:
+                LOG.info('Pool %s: expired idle server %s', self.pool,
+                         server.id)
+            else:
+                LOG.error('Server %s: error while deleting: %s', server.id, e)
+        return [x for x in members if x not in expired]
+
+    def rebuild_server(self, args):
+        server, name = args
+        requested = monotonic()
+        rebuilt = self.api_call(
+            self.client.servers.rebuild,
+            server,
+            self.image,
+            name=name,
+            meta=self.server_metadata(),
+            userdata=self.userdata)
+        self.track_server(rebuilt, requested)
+        return rebuilt
+
+    def state_create_servers(self):
+        '''Rebuild idle pool servers and create the missing ones'''
+        self.add_server_rollbacks()
+        self.start_journal()
+
+        members = self.expire_idle(self.list_pool())
+        spec = self.pool_spec()
+        idle = [x for x in members
+                if x.status in REBUILDABLE and
+                not getattr(x, 'OS-EXT-STS:task_state', None) and
+                x.metadata.get(POOL_SPEC_KEY) == spec]
+        # Least recently used first so that the whole pool stays fresh
+        idle.sort(key=last_used)
+        names = ['{}{}'.format(self.server_name_prefix, i)
+                 for i in range(1, self.count + 1)]
+        results = run_concurrently(self.rebuild_server,
+                                   list(zip(idle, names)),
+                                   self.create_concurrency)
+        for (server, _), _, e in results:
+            # Most likely another run got to it first
+            if e is not None:
+                LOG.warning('Server %s: cannot rebuild: %s', server.id, e)
+        LOG.info('Pool %s: rebuilt %d of %d idle servers', self.pool,
+                 len(self.tracked), len(idle))
+
+        missing = names[len(self.tracked):]
+        if len(members) + len(missing) - len(self.tracked) > self.pool_size:
+            LOG.info('Pool %s: full, new servers are deleted after the run',
+                     self.pool)
+        self.create_servers(missing)
+
+        self.servers = [x.server for x in self.tracked.values()]
+        LOG.info("Test servers: %s", ' '.join(x.id for x in self.servers))
+        if self.pipeline:
+            self.next_state(self.state_run_servers)
+        else:
+            self.next_state(self.state_wait_for_active)
+
+    def keep_in_pool(self, tracked):
+        '''Reserve a place in the pool for a server that passed'''
+        if not tracked.passed:
+            return False
+        with self.pool_lock:
+            if tracked.id in self.pooled:
+                return True
+            if self.others is None:
+                self.others = len([x for x in self.list_pool()
+                                   if x.id not in self.tracked])
+            if self.others + len(self.pooled) >= self.pool_size:
+                return False
+            self.pooled.add(tracked.id)
+        LOG.info('Server %s: kept in pool %s', tracked.id, self.pool)
+        return True
+
+    def leftover_servers(self):
+        # Servers kept in the pool are left behind on purpose
+        return [x for x in super(WarmPoolTest, self).leftover_servers()
+                if x.id not in self.pooled]
+
+    def delete_server(self, tracked):
+        if self.keep_in_pool(tracked):
+            tracked.transition(ServerWorkFlow.LOGS_SAVED)
+            return
+        super(WarmPoolTest, self).delete_server(tracked)